@@ -2,130 +2,209 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 from modules.data_analysis import *
+from modules.cache import memo
+from modules.perf import section
+from modules import parallel, shared
+from modules.sketches import approx_segment_stats, sketch_table
 import plotly.express as px
+from tables import paged_dataframe
+
+def basic_statistics(data: pd.DataFrame, key: str) -> None:
+    '''
+    renders basic statistics for all, active and inactive donors
+    '''
+    st.markdown("<h2 style='text-align: center;'>Basic Statistics</h2>", unsafe_allow_html=True)
+    st.space(size="medium")
+
+    st.markdown("<h4 style='text-align: center;'>Basic Statistics for All Donors</h4>", unsafe_allow_html=True)
+    st.write("**Donors:** Number of unique donors  \
+            \n**Total Donation Amount:** Total donated among all donors  \
+            \n**Average Total Donation:** Average total donation per donor  \
+            \n**Median Total Donation:** Median total donation per donor  \
+            \n**Modal Total Donation:** Modal total donation per donor")
+    approximate = st.toggle("Approximate", key="analytics_approximate",
+                            help="Estimate donors, medians and modes from sketches, faster on very large data")
+    if approximate:
+        # the sketches are kept up to date by the dataset merger, built from the data if there are none
+        sketch = st.session_state.get("sketches")
+        segments = sketch_table(sketch) if sketch is not None else memo(key, approx_segment_stats, data)
+    else:
+        segments = memo(key, parallel.segment_stats if parallel.ENABLED else segment_stats, data)
+    stats = basic_stats(data, segments)
+    st.dataframe(stats)
+    st.space(size="small")
+
+    st.markdown("<h4 style='text-align: center;'>Basic Statistics for Active Donors</h4>", unsafe_allow_html=True)
+    st.write("**Active Donor:** Donor who has donated at least once within the past 18 months.")
+    stats_active = active_donors(data, segments)
+    st.dataframe(stats_active)
+    st.space(size="small")
+    
+    st.markdown("<h4 style='text-align: center;'>Basic Statistics for Inactive Donors</h4>", unsafe_allow_html=True)
+    st.write("**Inactive Donor:** Donor who has not donated within the past 18 months.")
+    stats_inactive = inactive_donors(data, segments)
+    st.dataframe(stats_inactive)
+
+def top_donor_tables(data: pd.DataFrame, key: str) -> None:
+    '''
+    renders top donors by amount and by frequency
+    '''
+    st.markdown("<h2 style='text-align: center;'>Top Donors</h2>", unsafe_allow_html=True)
+    st.space(size="medium")
+    
+    st.markdown("<h4 style='text-align: center;'>Top 50 Donors by Total Amount Donated</h4>", unsafe_allow_html=True)
+    top_amt = memo(key, top_donors, data, 50)
+    st.dataframe(top_amt)
+    st.space(size="small")
+
+    col1, empty, col2 = st.columns([3, 1, 3])
+    
+    with col1:
+        status = top_amt["Number of Gifts Past 18 Months"].apply(lambda x: "Active" if x>0 else "Inactive")
+        activity_counts = status.value_counts()
+        fig = px.pie(names=activity_counts.index, values=activity_counts.values, title="Active/Inactive Top Donors", color_discrete_sequence=px.colors.qualitative.Prism)
+        st.plotly_chart(fig)
+
+    with col2: 
+        state_counts = top_amt["State"].value_counts()
+        fig = px.pie(names=state_counts.index, values=state_counts.values, title="States of Top Donors", color_discrete_sequence=px.colors.qualitative.Prism)
+        st.plotly_chart(fig)
+
+    st.markdown("<h4 style='text-align: center;'>Top 50 Donors by Donation Frequency (Past 18 Months)</h4>", unsafe_allow_html=True)
+    top_freq = memo(key, frequent_donors, data, 50)
+    st.dataframe(top_freq)
+
+def donors_by_location(data: pd.DataFrame, key: str) -> None:
+    '''
+    renders donors by state, city and without location
+    '''
+    st.markdown("<h2 style='text-align: center;'>Donors by State and City</h2>", unsafe_allow_html=True)
+    st.space(size="medium")
+
+    st.markdown("<h4 style='text-align: center;'>Donors by State</h4>", unsafe_allow_html=True)
+    st.write("**Cities:** Number of unique cities donated from in the state  \
+            \n**Donors:** Number of unique donors in the state  \
+            \n**Total Gifts (All Time):** Total donated from the state  \
+            \n**Number of Gifts Past 18 Months:** Number of donations in the past 18 months from the state")
+    
+    rollup = st.session_state.get("rollup")
+    if rollup is None and parallel.ENABLED:
+        rollup = memo(key, parallel.location_rollup, data)
+    states = memo(key, stats_by_state, data, rollup)
+    st.dataframe(states)
+    st.space(size="small")
+
+    # separating out states with .85% of donors from the rest for pie chart
+    threshold = 0.0085
+    states_pie = states[states["Donors"] / states["Donors"].sum() >= threshold]
+    other_states = states[states["Donors"] / states["Donors"].sum() < threshold]
+    other_total = other_states["Donors"].sum()
+    states_pie.loc["Other"] = other_total
+
+    # pie chart of states and donors
+    fig = px.pie(states_pie, names=states_pie.index, values="Donors",  title="Percentage of Donors from Each State", color_discrete_sequence=px.colors.qualitative.Prism)
+    st.plotly_chart(fig)
+
+    st.markdown("<h4 style='text-align: center;'>Donors by City</h4>", unsafe_allow_html=True)
+    st.write("**Donors:** Number of unique donors in the city  \
+            \n**Total Gifts (All Time):** Total donated from the city  \
+            \n**Number of Gifts Past 18 Months:** Number of donations in the past 18 months from the city")
+    cities = memo(key, stats_by_city, data, rollup)
+    paged_dataframe(cities, "cities", key)
+    st.space(size="small")
+
+    st.markdown("<h4 style='text-align: center;'>Donors Without Location</h4>", unsafe_allow_html=True)
+    st.write("**Country Only:** Donors whose city _and_ state are not included  \
+            \n**No Location:** Donors with _no_ location information")
+    no_location = memo(key, stats_no_location, data)
+    st.dataframe(no_location)
+
+def donors_by_date(data: pd.DataFrame, key: str) -> None:
+    '''
+    renders donors by year and month of their last gift
+    '''
+    st.markdown("<h2 style='text-align: center;'>Donors by Month and Year</h2>", unsafe_allow_html=True)
+    st.space(size="medium")
+
+    st.markdown("<h4 style='text-align: center;'>Donors by Year</h4>", unsafe_allow_html=True)
+    st.markdown("<p style='text-align: center;'>Years and the number of donors whose last donation was in that year.</p>", unsafe_allow_html=True)
+    # year, month and window stats all read the date histogram kept by the dataset merger
+    dates = st.session_state.get("dates")
+    if dates is None:
+        dates = memo(key, date_histogram, data)
+    yearly = memo(key, stats_by_year, data, dates)
+    st.bar_chart(yearly, x_label="Year", y_label="Donors", color="#007633")
+
+    st.space(size="small")
+    st.markdown("<h4 style='text-align: center;'>Donors by Month</h4>", unsafe_allow_html=True)
+    st.markdown("<p style='text-align: center;'>Months and the number of donors whose last donation was in that month.</p>", unsafe_allow_html=True)
+    monthly = memo(key, stats_by_month, data, dates)
+    st.bar_chart(monthly, x_label="Month", y_label="Donors", color="#007633", sort=False)
+
+    st.space(size="small")
+    st.markdown("<h4 style='text-align: center;'>Active Donors Over Time</h4>", unsafe_allow_html=True)
+    st.markdown("<p style='text-align: center;'>Donors whose last donation was within the 18 months before the end of each month.</p>", unsafe_allow_html=True)
+    # chart a copy, the memoized table is shared by every run and session
+    active = memo(key, rolling_donors, dates, 18, "M")
+    active = active.set_axis(active.index.to_timestamp())
+    st.line_chart(active, x_label="Month", y_label="Donors", color="#007633")
+
+    st.space(size="small")
+    st.markdown("<h4 style='text-align: center;'>Lapsed Donors</h4>", unsafe_allow_html=True)
+    st.markdown("<p style='text-align: center;'>Donors whose last donation was within the past 18 months and donors whose last donation was before then.</p>", unsafe_allow_html=True)
+    # today is part of the key, so the counts move on with the date
+    lapsed = memo(key, lapsed_donors, dates, 18, pd.Timestamp.today().normalize())
+    st.dataframe(lapsed)
+
+def donor_tiers(data: pd.DataFrame, key: str) -> None:
+    '''
+    renders donors by giving tier under each tier scheme and by recency and amount
+    '''
+    st.markdown("<h2 style='text-align: center;'>Donor Tiers</h2>", unsafe_allow_html=True)
+    st.space(size="medium")
+
+    st.markdown("<h4 style='text-align: center;'>Donors by Tier</h4>", unsafe_allow_html=True)
+    st.write("**Riverkeeper:** Giving levels from Riverkeeper's website  \
+            \n**Giving Levels:** Mid-level and major donor bands  \
+            \n**Share of Donors:** Percent of donors in the scheme who are in the tier")
+    tiers = memo(key, stats_by_tier, data)
+    st.dataframe(tiers)
+    st.space(size="small")
+
+    st.markdown("<h4 style='text-align: center;'>Donors by Recency and Amount</h4>", unsafe_allow_html=True)
+    st.write("**Segment:** Time since the last donation and Riverkeeper giving level")
+    # recency depends on the day, so today is part of the cache key
+    rfm = memo(key, stats_by_rfm, data, pd.Timestamp.today().normalize())
+    st.dataframe(rfm)
+
+# page sections, each rendered only while its tab is selected
+SECTIONS = {
+    "Basic Statistics" : basic_statistics,
+    "Top Donors" : top_donor_tables,
+    "Donors by Location" : donors_by_location,
+    "Donors by Date" : donors_by_date,
+    "Donor Tiers" : donor_tiers,
+}
+
+def run():
 
-st.set_page_config(
+    st.set_page_config(
     page_title="Donor Analytics",
     page_icon="📊",
     layout="wide"
-)
-
-def run():
+    )
 
-    # clean data
-    data = clean(st.session_state.df)
+    # clean data once per dataset, results below are cached on the dataset fingerprint
+    shared.attach(st.session_state)
+    key = st.session_state.df_fingerprint
+    with section("analytics: clean"):
+        data = memo(key, cleaned, st.session_state.df)
 
     # convert to biokind format
 
-    tab1, tab2, tab3, tab4 = st.tabs([
-            "Basic Statistics",
-            "Top Donors",
-            "Donors by Location",
-            "Donors by Date"
-        ])
-
-    with tab1:
-        st.markdown("<h2 style='text-align: center;'>Basic Statistics</h2>", unsafe_allow_html=True)
-        st.space(size="medium")
-       
-        st.markdown("<h4 style='text-align: center;'>Basic Statistics for All Donors</h4>", unsafe_allow_html=True)
-        st.write("**Donors:** Number of unique donors  \
-                \n**Total Donation Amount:** Total donated among all donors  \
-                \n**Average Total Donation:** Average total donation per donor  \
-                \n**Median Total Donation:** Median total donation per donor  \
-                \n**Modal Total Donation:** Modal total donation per donor")
-        stats = basic_stats(data)
-        st.dataframe(stats)
-        st.space(size="small")
-
-        st.markdown("<h4 style='text-align: center;'>Basic Statistics for Active Donors</h4>", unsafe_allow_html=True)
-        st.write("**Active Donor:** Donor who has donated at least once within the past 18 months.")
-        stats_active = active_donors(data)
-        st.dataframe(stats_active)
-        st.space(size="small")
-        
-        st.markdown("<h4 style='text-align: center;'>Basic Statistics for Inactive Donors</h4>", unsafe_allow_html=True)
-        st.write("**Inactive Donor:** Donor who has not donated within the past 18 months.")
-        stats_inactive = inactive_donors(data)
-        st.dataframe(stats_inactive)
-
-    with tab2:
-        st.markdown("<h2 style='text-align: center;'>Top Donors</h2>", unsafe_allow_html=True)
-        st.space(size="medium")
-        
-        st.markdown("<h4 style='text-align: center;'>Top 50 Donors by Total Amount Donated</h4>", unsafe_allow_html=True)
-        top_amt = top_donors(data, 50)
-        st.dataframe(top_amt)
-        st.space(size="small")
-
-        col1, empty, col2 = st.columns([3, 1, 3])
-        
-        with col1:
-            top_amt["Status"] = top_amt["Number of Gifts Past 18 Months"].apply(lambda x: "Active" if x>0 else "Inactive")
-            activity_counts = top_amt["Status"].value_counts()
-            fig = px.pie(names=activity_counts.index, values=activity_counts.values, title="Active/Inactive Top Donors", color_discrete_sequence=px.colors.qualitative.Prism)
-            st.plotly_chart(fig)
-
-        with col2: 
-            state_counts = top_amt["State"].value_counts()
-            fig = px.pie(names=state_counts.index, values=state_counts.values, title="States of Top Donors", color_discrete_sequence=px.colors.qualitative.Prism)
-            st.plotly_chart(fig)
-
-        st.markdown("<h4 style='text-align: center;'>Top 50 Donors by Donation Frequency (Past 18 Months)</h4>", unsafe_allow_html=True)
-        top_freq = frequent_donors(data, 50)
-        st.dataframe(top_freq)
-
-    with tab3:
-
-        st.markdown("<h2 style='text-align: center;'>Donors by State and City</h2>", unsafe_allow_html=True)
-        st.space(size="medium")
-
-        st.markdown("<h4 style='text-align: center;'>Donors by State</h4>", unsafe_allow_html=True)
-        st.write("**Cities:** Number of unique cities donated from in the state  \
-                \n**Donors:** Number of unique donors in the state  \
-                \n**Total Gifts (All Time):** Total donated from the state  \
-                \n**Number of Gifts Past 18 Months:** Number of donations in the past 18 months from the state")
-        
-        states = stats_by_state(data)
-        st.dataframe(states)
-        st.space(size="small")
-
-        # separating out states with .85% of donors from the rest for pie chart
-        threshold = 0.0085
-        states_pie = states[states["Donors"] / states["Donors"].sum() >= threshold]
-        other_states = states[states["Donors"] / states["Donors"].sum() < threshold]
-        other_total = other_states["Donors"].sum()
-        states_pie.loc["Other"] = other_total
-
-        # pie chart of states and donors
-        fig = px.pie(states_pie, names=states_pie.index, values="Donors",  title="Percentage of Donors from Each State", color_discrete_sequence=px.colors.qualitative.Prism)
-        st.plotly_chart(fig)
-
-        st.markdown("<h4 style='text-align: center;'>Donors by City</h4>", unsafe_allow_html=True)
-        st.write("**Donors:** Number of unique donors in the city  \
-                \n**Total Gifts (All Time):** Total donated from the city  \
-                \n**Number of Gifts Past 18 Months:** Number of donations in the past 18 months from the city")
-        cities = stats_by_city(data)
-        st.dataframe(cities)
-        st.space(size="small")
-
-        st.markdown("<h4 style='text-align: center;'>Donors Without Location</h4>", unsafe_allow_html=True)
-        st.write("**Country Only:** Donors whose city _and_ state are not included  \
-                \n**No Location:** Donors with _no_ location information")
-        no_location = stats_no_location(data)
-        st.dataframe(no_location)
-
-    with tab4:
-        st.markdown("<h2 style='text-align: center;'>Donors by Month and Year</h2>", unsafe_allow_html=True)
-        st.space(size="medium")
-
-        st.markdown("<h4 style='text-align: center;'>Donors by Year</h4>", unsafe_allow_html=True)
-        st.markdown("<p style='text-align: center;'>Years and the number of donors whose last donation was in that year.</p>", unsafe_allow_html=True)
-        yearly = stats_by_year(data)
-        st.bar_chart(yearly, x_label="Year", y_label="Donors", color="#007633")
-
-        st.space(size="small")
-        st.markdown("<h4 style='text-align: center;'>Donors by Month</h4>", unsafe_allow_html=True)
-        st.markdown("<p style='text-align: center;'>Months and the number of donors whose last donation was in that month.</p>", unsafe_allow_html=True)
-        monthly = stats_by_month(data)
-        st.bar_chart(monthly, x_label="Month", y_label="Donors", color="#007633", sort=False)
\ No newline at end of file
+    # only the selected tab is computed, sections already computed for this dataset come from the cache
+    tabs = st.tabs(list(SECTIONS), key="analytics_section", on_change="rerun")
+    for tab, (name, render) in zip(tabs, SECTIONS.items()):
+        if tab.open:
+            with tab, section(f"analytics: {name}"):
+                render(data, key)
@@ -0,0 +1,122 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import time
+import tracemalloc
+
+from modules.data_analysis import *
+from modules.merge_csv import merge_csv
+from modules.synthetic import SIZES, generate, upload
+
+BASELINE_PATH = "benchmark_baseline.json"
+
+# slower than this many times the baseline counts as a regression
+THRESHOLD = 1.25
+
+# uploads merged into each dataset: (rows as a fraction of the dataset, fraction of rows that already exist)
+MERGES = [(0.01, 0.1), (0.01, 0.5), (0.01, 0.9), (0.1, 0.5)]
+
+def cases(raw, data):
+    '''
+    returns {name: function} of everything benchmarked for one dataset
+    raw is the export as read from csv and data is its cleaned copy
+    '''
+    res = {
+        "clean" : lambda: cleaned(raw),
+        "segment_stats" : lambda: segment_stats(data),
+        "basic_stats" : lambda: basic_stats(data),
+        "active_donors" : lambda: active_donors(data),
+        "inactive_donors" : lambda: inactive_donors(data),
+        "top_donors" : lambda: top_donors(data, 50),
+        "frequent_donors" : lambda: frequent_donors(data, 50),
+        "location_rollup" : lambda: location_rollup(data),
+        "stats_by_state" : lambda: stats_by_state(data),
+        "stats_by_city" : lambda: stats_by_city(data),
+        "stats_no_location" : lambda: stats_no_location(data),
+        "stats_by_year" : lambda: stats_by_year(data),
+        "stats_by_month" : lambda: stats_by_month(data),
+        "date_histogram" : lambda: date_histogram(data),
+        "stats_by_period" : lambda: stats_by_period(data, "W"),
+        "categorize_donors" : lambda: categorize_donors(data),
+        "stats_by_tier" : lambda: stats_by_tier(data),
+    }
+    for size, overlap in MERGES:
+        new = cleaned(upload(raw, max(int(len(raw) * size), 1), overlap))
+        res[f"merge_csv {size:.0%} upload {overlap:.0%} overlap"] = lambda new=new: merge_csv(data, new, save=False)
+    return res
+
+def measure(fn, repeat: int) -> dict:
+    '''
+    returns the best wall time of repeat runs and the peak memory allocated by one traced run
+    '''
+    times = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - start)
+        tracemalloc.start()
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {"seconds" : min(times), "peak_mb" : peak / 1024 ** 2}
+
+def run(sizes: list, repeat: int) -> dict:
+    '''
+    benchmarks every case at every size, returns {size: {case: measurement}}
+    '''
+    results = {}
+    for size in sizes:
+        raw = generate(SIZES[size])
+        data = cleaned(raw)
+        results[size] = {}
+        for name, fn in cases(raw, data).items():
+            results[size][name] = measure(fn, repeat)
+            print(f"{size:>4} {name:<40} {results[size][name]['seconds']:9.4f}s {results[size][name]['peak_mb']:9.1f} MB")
+    return results
+
+def compare(results: dict, baseline: dict) -> list:
+    '''
+    prints each result against the baseline and returns the cases slower than THRESHOLD times the baseline
+    '''
+    regressions = []
+    for size, measured in results.items():
+        for name, m in measured.items():
+            base = baseline.get(size, {}).get(name)
+            if base is None:
+                continue
+            ratio = m["seconds"] / max(base["seconds"], 1e-9)
+            mem_ratio = m["peak_mb"] / max(base["peak_mb"], 1e-9)
+            flag = ""
+            if ratio > THRESHOLD or mem_ratio > THRESHOLD:
+                flag = "  REGRESSION"
+                regressions.append((size, name))
+            print(f"{size:>4} {name:<40} time x{ratio:5.2f}  memory x{mem_ratio:5.2f}{flag}")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark data_analysis and merge_csv on synthetic donor data.")
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=["10k", "100k"])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--save", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.repeat)
+
+    if args.save:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f))
+        if regressions:
+            raise SystemExit(f"{len(regressions)} benchmark(s) regressed")
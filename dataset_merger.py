@@ -1,24 +1,48 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import os
-from modules.merge_csv import merge_csv
-
-PATH = "donor_data.csv"
-
-# load existing data if the file exists
-# if it does not exist, create an empty dataframe
-def load_data():
-        if os.path.exists(PATH):
-            return pd.read_csv(PATH)
-        else:
-            df = pd.DataFrame()
-            df.to_csv(PATH, index=False)
-            return df
-    
-# save data to csv
-def save_data(df):
-    df.to_csv(PATH, index=False)
+from modules.merge_csv import merge_csv_chunks, touched_rows, with_columns
+from modules.data_analysis import clean, location_rollup, update_rollup, date_histogram, update_date_histogram
+from modules.dataset import save_data, rollback_data, data_history, save_rollup, save_dates, save_sketches
+from modules.sketches import sketch_partials, update_sketches
+from modules import cache, shared
+from tables import paged_dataframe
+
+# number of uploaded rows read and merged at a time
+CHUNK_SIZE = 100_000
+
+def _indexes(snap: dict) -> tuple:
+    '''
+    returns the snapshot's location rollup, date histogram and segment sketches, built from its data if missing
+    '''
+    rollup = snap["rollup"]
+    if rollup is None:
+        rollup = location_rollup(snap["df"].reindex(columns=["Account ID", "City", "State", "Total Gifts (All Time)", "Number of Gifts Past 18 Months"]))
+    dates = snap["dates"]
+    if dates is None:
+        dates = date_histogram(snap["df"].reindex(columns=["Account ID", "Last Gift Date"]))
+    sketch = snap["sketches"]
+    if sketch is None:
+        sketch = sketch_partials(snap["df"].reindex(columns=["Account ID", "Total Gifts (All Time)", "Number of Gifts Past 18 Months"]))
+    return rollup, dates, sketch
+
+def _update(indexes: tuple, before: pd.DataFrame, after: pd.DataFrame) -> tuple:
+    '''
+    updates the rollup, date histogram and sketches with only the rows a change touched
+    '''
+    rollup, dates, sketch = indexes
+    return update_rollup(rollup, before, after), update_date_histogram(dates, before, after), update_sketches(sketch, before, after)
+
+def _publish(df: pd.DataFrame, rollup: pd.DataFrame, dates: pd.Series, sketch: dict) -> None:
+    '''
+    saves the indexes of new data and makes it the shared data of every session
+    '''
+    save_rollup(rollup)
+    save_dates(dates)
+    save_sketches(sketch)
+    cache.invalidate()
+    shared.publish(df, rollup, dates, sketch)
+    shared.attach(st.session_state)
 
 def run():
 
@@ -32,26 +56,66 @@ def run():
     st.write("Upload a new dataset below to merge with the existing dataset.")
     st.space(size="small")
 
-    # load dataset into the user's session if it does not already exist
-    if "df" not in st.session_state:
-        st.session_state.df = load_data()
+    # every session shares one copy of the dataset, and picks up merges made in other sessions
+    shared.attach(st.session_state)
 
     # button to upload new csv
     uploaded_file = st.file_uploader("", type="csv")
 
-    if uploaded_file:
+    # an upload stays in the uploader across reruns, merge it only once
+    if uploaded_file and st.session_state.get("merged_upload") != uploaded_file.file_id:
 
-        # merge datasets
-        new_df = pd.read_csv(uploaded_file)
-        merged_df, _ = merge_csv(st.session_state.df, new_df, save=False)
+        # merge datasets chunk by chunk so memory use is bounded by the chunk size
+        bar = st.progress(0.0, text="Merging uploaded rows...")
+        def progress(rows):
+            done = min(uploaded_file.tell() / max(uploaded_file.size, 1), 1.0)
+            bar.progress(done, text=f"Merged {rows:,} uploaded rows")
 
-        # save the merged data and update the session state
-        save_data(merged_df)
-        st.session_state.df = merged_df
+        # merges run one at a time, each on the latest shared data
+        with shared.writer() as snap:
 
+            # keep the location rollup, date histogram and sketches up to date with only the rows each chunk changed
+            indexes = _indexes(snap)
+            touched = []
+            def on_change(before, after):
+                nonlocal indexes
+                indexes = _update(indexes, before, after)
+                touched.append(after["Account ID"])
+
+            df_old = snap["df"]
+            # chunks are cleaned with every column, so merged rows come with the columns clean derives
+            chunks = (clean(with_columns(chunk)) for chunk in pd.read_csv(uploaded_file, chunksize=CHUNK_SIZE))
+            merged_df, new_rows = merge_csv_chunks(df_old, chunks, progress, on_change)
+            bar.empty()
+
+            # save only the rows the upload changed as a new version and share the merged data
+            changed = touched_rows(merged_df, pd.DataFrame({"Account ID" : pd.concat(touched, ignore_index=True)})) if touched else merged_df
+            save_data(df_old, merged_df, changed)
+            _publish(merged_df, *indexes)
+        st.session_state.merged_upload = uploaded_file.file_id
+
+        # keep the upload's rows for the preview, which reruns as it is paged through
+        st.session_state.upload_preview = {
+            "Rows changed by the upload" : (changed, cache.fingerprint(changed)),
+            "New rows" : (new_rows, cache.fingerprint(new_rows)),
+        }
         st.success("Merged CSV saved and updated!")
         st.space(size="small")
 
-        # display new data
-        st.write("Merged Dataset:")
-        st.dataframe(merged_df)
+    # display the rows of the last upload, or the whole dataset, one page at a time
+    if "upload_preview" in st.session_state:
+        previews = {**st.session_state.upload_preview, "Merged dataset" : (st.session_state.df, st.session_state.df_fingerprint)}
+        shown = st.radio("Preview", list(previews), horizontal=True, key="preview_rows")
+        paged_dataframe(previews[shown][0], f"preview_{list(previews).index(shown)}", previews[shown][1])
+
+    # every upload is kept as a version that can be rolled back
+    with st.expander("Versions"):
+        history = data_history()
+        st.dataframe(history)
+        version = st.selectbox("Roll back to version", history.index[::-1], index=min(1, len(history) - 1))
+        if st.button("Roll back", disabled=version == history.index[-1]):
+            with shared.writer() as snap:
+                df, before, after = rollback_data(snap["df"], version)
+                _publish(df, *_update(_indexes(snap), before, after))
+            st.toast(f"Rolled back to version {version}.")
+            st.rerun()
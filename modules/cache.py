@@ -0,0 +1,71 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# limits for the process-wide result cache, least recently used entries are evicted first
+MAX_ENTRIES = 64
+MAX_BYTES = 1024 * 1024 * 1024
+
+_entries = OrderedDict()
+_size = 0
+_lock = threading.Lock()
+
+def fingerprint(df: pd.DataFrame) -> str:
+    '''
+    returns a content hash of the dataframe used to key cached results
+    '''
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr(list(df.columns)).encode())
+    h.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+def size_of(value) -> int:
+    '''
+    approximate size of a cached value in bytes
+    '''
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    return 0
+
+def memo(key: str, fn, *args):
+    '''
+    returns fn(*args), computing it only once per dataset fingerprint key and arguments
+    dataframe arguments are assumed to derive from the dataset the key was computed from and are not part of the cache key
+    cached values are shared, callers must not modify them
+    '''
+    global _size
+    params = [arg for arg in args if not isinstance(arg, (pd.DataFrame, pd.Series))]
+    entry_key = (key, fn.__module__, fn.__qualname__, repr(params))
+    with _lock:
+        if entry_key in _entries:
+            _entries.move_to_end(entry_key)
+            return _entries[entry_key][0]
+
+    value = fn(*args)
+    nbytes = size_of(value)
+
+    with _lock:
+        if entry_key not in _entries:
+            _entries[entry_key] = (value, nbytes)
+            _size += nbytes
+        # evict least recently used entries until within limits
+        while len(_entries) > 1 and (len(_entries) > MAX_ENTRIES or _size > MAX_BYTES):
+            _, (_, evicted) = _entries.popitem(last=False)
+            _size -= evicted
+    return value
+
+def invalidate() -> None:
+    '''
+    drops every cached result, called whenever a new dataset is saved
+    '''
+    global _size
+    with _lock:
+        _entries.clear()
+        _size = 0
@@ -2,9 +2,16 @@ import pandas as pd
 import numpy as np
 from decimal import Decimal, getcontext
 import calendar
+import weakref
+from modules.perf import timed
+from modules.tiers import SCHEMES, rfm_segments, tier, tier_many
 
 getcontext().prec = 32
 
+# uniform casing of each location column
+LOCATION_CASING = {"City": str.title, "State": str.upper, "Country": str.title}
+
+@timed
 def categorize_donors(df: pd.DataFrame) -> pd.DataFrame:
     '''
     adds a column to the dataset categorizing donors based on amount
@@ -13,52 +20,323 @@ def categorize_donors(df: pd.DataFrame) -> pd.DataFrame:
         donors of $20 or more receive email newsletters, invitations, etc.
         donors of $50 or more receive the opportunity to vote on the Board of Directors at an annual Membership meeting
         donors of $250 or more are listed in the annual Impact Report
+    the column is an ordered categorical, see modules.tiers for other schemes
     '''
-    df.loc[(df["Total Gifts (All Time)"] < 20), "Category"] = "under 20"
-    df.loc[(df["Total Gifts (All Time)"] >= 20) & (df["Total Gifts (All Time)"] < 50), "Category"] = "20+"
-    df.loc[(df["Total Gifts (All Time)"] >= 50) & (df["Total Gifts (All Time)"] < 250), "Category"] = "50+"
-    df.loc[df["Total Gifts (All Time)"] >= 250, "Category"] = "250+"
+    df["Category"] = tier(df["Total Gifts (All Time)"], *SCHEMES["Riverkeeper"])
     return df
 
-def clean(df: pd.DataFrame) -> None:
+def to_dollars(amounts: pd.Series) -> pd.Series:
+    '''
+    parses dollar amounts ("$1,234.56" strings or plain numbers) into floats
+    missing amounts stay null
+    '''
+    if not pd.api.types.is_numeric_dtype(amounts):
+        amounts = pd.to_numeric(amounts.astype("string").str.replace(r"[$,]", "", regex=True))
+    return amounts.astype("float64")
+
+@timed
+def to_cents(amounts: pd.Series) -> pd.Series:
+    '''
+    parses dollar amounts ("$1,234.56" strings or plain numbers) into int64 cents
+    missing amounts become 0 cents
+    '''
+    cents = np.rint(to_dollars(amounts).to_numpy(dtype="float64", na_value=0.0) * 100)
+    return pd.Series(cents.astype("int64"), index=amounts.index, name="Total Gifts Cents")
+
+def intern_location(values: pd.Series, casing) -> pd.Series:
+    '''
+    returns location values as a categorical with uniform casing and blanks as nulls
+    only the distinct values are normalized, rows are mapped to them by integer code
+    '''
+    codes, uniques = pd.factorize(values)
+    names = pd.Index([casing(str(name).strip()) for name in uniques], dtype=object)
+    names = names.where(names != "")
+    name_codes, categories = pd.factorize(names)
+    codes = np.where(codes >= 0, np.append(name_codes, -1)[codes], -1)
+    return pd.Series(pd.Categorical.from_codes(codes, categories), index=values.index, name=values.name)
+
+@timed
+def clean(df: pd.DataFrame) -> pd.DataFrame:
     '''
     converts numeric data to numeric types and dates to datetime type and adds the category column
+    total gifts are also parsed once into the integer "Total Gifts Cents" column used by the money stats
+    city, state and country are interned as categoricals with uniform casing
+    columns missing from the dataframe are skipped, so partial uploads can be cleaned
+    modifies the dataframe in place and returns it
+    '''
+    for col, casing in LOCATION_CASING.items():
+        if col in df.columns:
+            df[col] = intern_location(df[col], casing)
+
+    # missing totals stay null in the dollar column, so merging an upload keeps the stored amount
+    if "Total Gifts (All Time)" in df.columns:
+        dollars = to_dollars(df["Total Gifts (All Time)"])
+        df["Total Gifts Cents"] = to_cents(dollars)
+        df["Total Gifts (All Time)"] = (df["Total Gifts Cents"] / 100).where(dollars.notna())
+        df = categorize_donors(df)
+    if "Number of Gifts Past 18 Months" in df.columns:
+        df["Number of Gifts Past 18 Months"] = pd.to_numeric(df["Number of Gifts Past 18 Months"])
+    if "Last Gift Date" in df.columns:
+        df["Last Gift Date"] = pd.to_datetime(df["Last Gift Date"])
+    return df
+
+@timed
+def cleaned(df: pd.DataFrame) -> pd.DataFrame:
+    '''
+    returns a cleaned copy of the dataframe, leaving the original untouched
     '''
-    df["Total Gifts (All Time)"] = df["Total Gifts (All Time)"].str.removeprefix("$").str.replace(",", "")
-    df["Total Gifts (All Time)"] = pd.to_numeric(df["Total Gifts (All Time)"])
-    df["Number of Gifts Past 18 Months"] = pd.to_numeric(df["Number of Gifts Past 18 Months"])
-    df["Last Gift Date"] = pd.to_datetime(df["Last Gift Date"])
-    df = categorize_donors(df)
+    return clean(df.copy())
 
 
 # basic stats
 
+@timed
 def donations_precise(df: pd.DataFrame) -> pd.Series:
     '''
     converts dollar amounts to Decimal objects to maintain precision
+    kept as the reference for the integer cents path, the stats below use donations_cents
     '''
     precise = df["Total Gifts (All Time)"].map(lambda x: Decimal(str(x)))
     return precise
 
+@timed
+def donations_cents(df: pd.DataFrame) -> np.ndarray:
+    '''
+    returns donation amounts as an int64 array of cents
+    uses the column parsed by clean when it is there
+    '''
+    if "Total Gifts Cents" in df.columns:
+        return df["Total Gifts Cents"].to_numpy(dtype="int64")
+    return to_cents(df["Total Gifts (All Time)"]).to_numpy()
+
+def donations_known(df: pd.DataFrame) -> np.ndarray:
+    '''
+    returns a boolean array of the rows that have a donation amount
+    blank amounts are 0 cents in donations_cents, but like the Decimal path the stats leave them
+    out of means, medians and modes while still counting them as donors
+    '''
+    return to_dollars(df["Total Gifts (All Time)"]).notna().to_numpy()
+
+def cents_to_dollars(cents: int) -> Decimal:
+    '''
+    converts a whole number of cents to an exact Decimal dollar amount
+    '''
+    return Decimal(int(cents)).scaleb(-2)
+
+def float_to_cents(dollars: float) -> int:
+    '''
+    rounds a float dollar amount to whole cents with round() on a numpy float, like the Decimal stats did
+    '''
+    return int(np.rint(round(np.float64(dollars), 2) * 100))
+
+def mean_cents(total: int, n: int) -> int:
+    '''
+    average of n amounts totalling total cents, rounded to the cent
+    pandas took the mean of the Decimal amounts as their exact sum in float divided by n, so this does the same
+    and half cent ties round like they always have
+    '''
+    return float_to_cents(float(cents_to_dollars(total)) / n)
+
+def midpoint_cents(lower: int, upper: int) -> int:
+    '''
+    median of an even number of amounts from the two middle cents values, rounded to the cent
+    averaged as floats like the Decimal median was
+    '''
+    return float_to_cents((int(lower) / 100 + int(upper) / 100) / 2)
+
+def sorted_median_cents(values: np.ndarray) -> int:
+    '''
+    median of an already sorted cents array, rounded to the cent
+    '''
+    mid = len(values) // 2
+    if len(values) % 2:
+        return int(values[mid])
+    return midpoint_cents(values[mid - 1], values[mid])
+
+def sorted_mode_cents(values: np.ndarray) -> int:
+    '''
+    smallest most frequent value of an already sorted cents array
+    '''
+    starts = np.flatnonzero(np.r_[True, values[1:] != values[:-1]])
+    counts = np.diff(np.r_[starts, len(values)])
+    return int(values[starts[np.argmax(counts)]])
+
+@timed
 def total_donations(df: pd.DataFrame) -> float:
-    donation_total = donations_precise(df).sum()
-    return round(donation_total, 2)
+    donation_total = donations_cents(df).sum()
+    return cents_to_dollars(donation_total)
 
+@timed
 def avg_total_donation(df: pd.DataFrame) -> float:
-    donation_avg = donations_precise(df).mean()
-    return round(donation_avg, 2)
+    cents = donations_cents(df)[donations_known(df)]
+    if len(cents) == 0:
+        return float("nan")
+    return cents_to_dollars(mean_cents(cents.sum(), len(cents)))
 
+@timed
 def median_total_donation(df: pd.DataFrame) -> float:
-    donation_median = donations_precise(df).median()
-    return round(donation_median, 2)
+    cents = donations_cents(df)[donations_known(df)]
+    if len(cents) == 0:
+        return float("nan")
+    return cents_to_dollars(sorted_median_cents(np.sort(cents)))
 
+@timed
 def modal_total_donation(df: pd.DataFrame) -> float:
-    donation_mode = donations_precise(df).mode()
-    if isinstance(donation_mode, pd.Series):
-        donation_mode = donation_mode.iloc[0]
-    return round(donation_mode, 2)
+    cents = donations_cents(df)[donations_known(df)]
+    if len(cents) == 0:
+        return float("nan")
+    return cents_to_dollars(sorted_mode_cents(np.sort(cents)))
+
+SEGMENTS = ["All", "Active", "Inactive"]
+
+def cents_histogram(sorted_cents: np.ndarray) -> tuple:
+    '''
+    returns (distinct values, counts) of an already sorted cents array
+    '''
+    if len(sorted_cents) == 0:
+        return sorted_cents, np.zeros(0, dtype="int64")
+    starts = np.flatnonzero(np.r_[True, sorted_cents[1:] != sorted_cents[:-1]])
+    return sorted_cents[starts], np.diff(np.r_[starts, len(sorted_cents)])
+
+def merge_histograms(histograms: list) -> tuple:
+    '''
+    adds up (values, counts) histograms into one sorted histogram
+    '''
+    values = np.concatenate([h[0] for h in histograms]).astype("int64")
+    counts = np.concatenate([h[1] for h in histograms]).astype("int64")
+    if len(values) == 0:
+        return values, counts
+    order = np.argsort(values, kind="stable")
+    values, counts = values[order], counts[order]
+    starts = np.flatnonzero(np.r_[True, values[1:] != values[:-1]])
+    return values[starts], np.add.reduceat(counts, starts)
+
+def histogram_median_cents(values: np.ndarray, counts: np.ndarray) -> int:
+    '''
+    median of a cents histogram, rounded to the cent
+    '''
+    n = int(counts.sum())
+    cumulative = np.cumsum(counts)
+    lower = values[np.searchsorted(cumulative, (n - 1) // 2, side="right")]
+    upper = values[np.searchsorted(cumulative, n // 2, side="right")]
+    if lower == upper:
+        return int(lower)
+    return midpoint_cents(lower, upper)
+
+@timed
+def segment_partials(df: pd.DataFrame) -> dict:
+    '''
+    computes mergeable partial aggregates for segment_stats in a single pass
+    keys of the partition are 0 = active, 1 = inactive, 2 = neither (negative gift counts)
+        histograms: (values, counts) of cents for each key, rows without an amount left out,
+        donors: unique donors for each key,
+        all donors: unique donors overall,
+        gifts: total gifts in the past 18 months for each key,
+        gift rows: rows with a known gift count for each key
+    partials of row sets that share no Account IDs can be added up exactly
+    '''
+    gifts = df["Number of Gifts Past 18 Months"].to_numpy(dtype="float64", na_value=np.nan)
+    cents = donations_cents(df)
+    ids = pd.factorize(df["Account ID"])[0]
+
+    # partition key
+    key = np.where(gifts > 0, 0, np.where((gifts == 0) | np.isnan(gifts), 1, 2))
+
+    # one sort of the known amounts serves the median and mode of every segment
+    has_amount = donations_known(df)
+    order = np.argsort(cents[has_amount], kind="stable")
+    sorted_cents = cents[has_amount][order]
+    sorted_key = key[has_amount][order]
+
+    # unique donors per segment from the distinct (donor, segment) pairs
+    known = ids >= 0
+    pairs = np.unique(ids[known].astype("int64") * 3 + key[known])
+
+    return {
+        "histograms" : [cents_histogram(sorted_cents[sorted_key == k]) for k in range(3)],
+        "donors" : np.bincount(pairs % 3, minlength=3),
+        "all donors" : int(ids.max()) + 1 if len(ids) else 0,
+        "gifts" : np.bincount(key, weights=np.nan_to_num(gifts), minlength=3),
+        "gift rows" : np.bincount(key, weights=~np.isnan(gifts), minlength=3)
+    }
+
+def merge_segment_partials(partials: list) -> dict:
+    '''
+    adds up segment_partials of row sets that share no Account IDs
+    '''
+    return {
+        "histograms" : [merge_histograms([p["histograms"][k] for p in partials]) for k in range(3)],
+        "donors" : sum(p["donors"] for p in partials),
+        "all donors" : sum(p["all donors"] for p in partials),
+        "gifts" : sum(p["gifts"] for p in partials),
+        "gift rows" : sum(p["gift rows"] for p in partials)
+    }
+
+def segment_table(partials: dict) -> pd.DataFrame:
+    '''
+    turns segment_partials into the segment_stats dataframe
+    '''
+    rows = []
+    for segment in SEGMENTS:
+        if segment == "All":
+            values, counts = merge_histograms(partials["histograms"])
+            n_donors = partials["all donors"]
+            n_gifts, n_gift_rows = partials["gifts"].sum(), partials["gift rows"].sum()
+        else:
+            k = SEGMENTS.index(segment) - 1
+            values, counts = partials["histograms"][k]
+            n_donors = int(partials["donors"][k])
+            n_gifts, n_gift_rows = partials["gifts"][k], partials["gift rows"][k]
+        total = int((values * counts).sum())
+        n = int(counts.sum())
+        empty = n == 0
+        rows.append({
+            "Donors" : n_donors,
+            "Total Donation Amount" : cents_to_dollars(total),
+            "Average Total Donation" : float("nan") if empty else cents_to_dollars(mean_cents(total, n)),
+            "Median Total Donation" : float("nan") if empty else cents_to_dollars(histogram_median_cents(values, counts)),
+            "Modal Total Donation" : float("nan") if empty else cents_to_dollars(int(values[np.argmax(counts)])),
+            "Gifts in Past 18 Months" : int(n_gifts),
+            "Average Gifts Past 18 Months" : round(n_gifts / n_gift_rows, 2) if n_gift_rows else float("nan")
+        })
+    return pd.DataFrame(rows, index=pd.Index(SEGMENTS, name="Segment"))
+
+@timed
+def segment_stats(df: pd.DataFrame) -> pd.DataFrame:
+    '''
+    computes the basic statistics for all, active and inactive donors in a single pass
+    active donors have at least one gift in the past 18 months, inactive donors have none
+    returns an unformatted dataframe indexed by segment with columns
+        number of unique donors,
+        total amount donated,
+        average total donation,
+        median total donation,
+        modal total donation,
+        number of donations in past 18 months,
+        average number of donations in past 18 months
+    '''
+    return segment_table(segment_partials(df))
+
+def segment_view(stats: pd.DataFrame, segment: str) -> pd.DataFrame:
+    '''
+    formats one row of segment_stats as a basic statistics table
+    '''
+    row = stats.loc[segment]
+    res = pd.DataFrame({
+        "Donors" : [int(row["Donors"])],
+        "Total Donation Amount" : [f"${row['Total Donation Amount']:,.2f}"],
+        "Average Total Donation" : [f"${row['Average Total Donation']:,.2f}"],
+        "Median Total Donation" : [f"${row['Median Total Donation']:,.2f}"],
+        "Modal Total Donation" : [f"${row['Modal Total Donation']:,.2f}"],
+        "Gifts in Past 18 Months" : [int(row["Gifts in Past 18 Months"])]
+    })
+    # stats from sketches say so
+    if "Approximate" in stats.columns:
+        res["Approximate"] = bool(row["Approximate"])
+    return res
 
-def basic_stats(df: pd.DataFrame) -> pd.DataFrame:
+@timed
+def basic_stats(df: pd.DataFrame, stats: pd.DataFrame = None) -> pd.DataFrame:
     '''
     returns a dataframe of basic statistics with columns
         number of unique donors,
@@ -67,37 +345,80 @@ def basic_stats(df: pd.DataFrame) -> pd.DataFrame:
         median total donation,
         modal total donation,
         number of donations in past 18 months
+    pass the result of segment_stats as stats to reuse it, or of sketches.approx_segment_stats for approximate stats
     '''
-    res = pd.DataFrame({
-        "Donors" : [df["Account ID"].nunique()],
-        "Total Donation Amount" : [f"${total_donations(df):,.2f}"],
-        "Average Total Donation" : [f"${avg_total_donation(df):,.2f}"],
-        "Median Total Donation" : [f"${median_total_donation(df):,.2f}"],
-        "Modal Total Donation" : [f"${modal_total_donation(df):,.2f}"],
-        "Gifts in Past 18 Months" : [int(df["Number of Gifts Past 18 Months"].sum())]
-    })
-    return res
+    if stats is None:
+        stats = segment_stats(df)
+    return segment_view(stats, "All")
 
-def active_donors(df: pd.DataFrame) -> pd.DataFrame:
+@timed
+def active_donors(df: pd.DataFrame, stats: pd.DataFrame = None) -> pd.DataFrame:
     '''
     basic stats for active donors with average number of gifts per donor in the past 18 months
     '''
-    active = df[df["Number of Gifts Past 18 Months"] > 0]
-    res = basic_stats(active)
-    res["Average Gifts Past 18 Months"] = round(active["Number of Gifts Past 18 Months"].mean(), 2)
+    if stats is None:
+        stats = segment_stats(df)
+    res = segment_view(stats, "Active")
+    res["Average Gifts Past 18 Months"] = stats.loc["Active", "Average Gifts Past 18 Months"]
     res.rename(columns={"Donors": "Active Donors"}, inplace=True)
     return res
 
-def inactive_donors(df: pd.DataFrame) -> pd.DataFrame:
+@timed
+def inactive_donors(df: pd.DataFrame, stats: pd.DataFrame = None) -> pd.DataFrame:
     '''
     basic stats for inactive donors
     '''
-    inactive = df[df["Number of Gifts Past 18 Months"] == 0 | np.isnan(df["Number of Gifts Past 18 Months"])]
-    res = basic_stats(inactive)
+    if stats is None:
+        stats = segment_stats(df)
+    res = segment_view(stats, "Inactive")
     res.rename(columns={"Donors": "Inactive Donors"}, inplace=True)
     return res
 
-def top_donors(df: pd.DataFrame, n: int) -> pd.DataFrame:
+@timed
+def top_positions(keys: list, k: int) -> np.ndarray:
+    '''
+    returns the row positions of the k rows with the largest keys without sorting every row
+    later keys break ties in earlier keys and remaining ties keep row order, like a stable descending sort
+    missing values rank last
+    '''
+    keys = [np.nan_to_num(np.asarray(key, dtype="float64"), nan=-np.inf) for key in keys]
+
+    def select(candidates: np.ndarray, level: int, k: int) -> np.ndarray:
+        if k <= 0:
+            return candidates[:0]
+        if len(candidates) <= k:
+            return candidates
+        if level == len(keys):
+            return candidates[:k]
+        values = keys[level][candidates]
+        threshold = np.partition(values, len(values) - k)[len(values) - k]
+        above = candidates[values > threshold]
+        tied = candidates[values == threshold]
+        return np.concatenate([above, select(tied, level + 1, k - len(above))])
+
+    chosen = select(np.arange(len(keys[0])), 0, k)
+
+    # order only the chosen rows
+    order = np.lexsort([chosen] + [-key[chosen] for key in reversed(keys)])
+    return chosen[order]
+
+def donor_rows(df: pd.DataFrame, positions: np.ndarray) -> pd.DataFrame:
+    '''
+    returns the donors at the given row positions formatted for display
+    '''
+    columns = ["Account ID", "City", "State", "Total Gifts (All Time)", "Last Gift Date", "Number of Gifts Past 18 Months"]
+    rows = df.iloc[positions][columns].replace("", np.nan)
+    rows["City"] = rows["City"].to_numpy(dtype=object)
+    rows["State"] = rows["State"].to_numpy(dtype=object)
+    # donors added by partial uploads can lack an amount or gift count, those stay blank
+    rows["Total Gifts (All Time)"] = rows["Total Gifts (All Time)"].map('${:,.2f}'.format, na_action="ignore")
+    rows["Last Gift Date"] = rows["Last Gift Date"].dt.date
+    rows["Number of Gifts Past 18 Months"] = rows["Number of Gifts Past 18 Months"].astype("Int64")
+    rows.reset_index(drop=True, inplace=True)
+    return rows
+
+@timed
+def top_donors(df: pd.DataFrame, n: int, offset: int = 0) -> pd.DataFrame:
     '''
     returns top n donors with 
         account id, 
@@ -106,17 +427,13 @@ def top_donors(df: pd.DataFrame, n: int) -> pd.DataFrame:
         total amount,
         last gift date,
         donations in past 18 months
+    offset skips that many top donors, for paging through large lists
     '''
-    df = df.replace("", np.nan)
-    sorted_donations = df.copy().sort_values(by="Total Gifts (All Time)", ascending=False)
-    top_donors = sorted_donations[:n].copy()
-    top_donors["Total Gifts (All Time)"] = top_donors["Total Gifts (All Time)"].apply(lambda x: '${:,.2f}'.format(x))
-    top_donors["Last Gift Date"] = top_donors["Last Gift Date"].dt.date
-    top_donors["Number of Gifts Past 18 Months"] = top_donors["Number of Gifts Past 18 Months"].astype(int)
-    top_donors.reset_index(drop=True, inplace=True)
-    return top_donors[["Account ID", "City", "State", "Total Gifts (All Time)", "Last Gift Date", "Number of Gifts Past 18 Months"]]
+    positions = top_positions([df["Total Gifts (All Time)"]], offset + n)[offset:]
+    return donor_rows(df, positions)
 
-def frequent_donors(df: pd.DataFrame, n: int) -> pd.DataFrame:
+@timed
+def frequent_donors(df: pd.DataFrame, n: int, offset: int = 0) -> pd.DataFrame:
     '''
     returns n most frequent donors with 
         account id, 
@@ -125,37 +442,122 @@ def frequent_donors(df: pd.DataFrame, n: int) -> pd.DataFrame:
         total amount,
         last gift date,
         donations in past 18 months
+    offset skips that many frequent donors, for paging through large lists
     '''
-    df = df.replace("", np.nan)
-    sorted_donations = df.copy().sort_values(by=["Number of Gifts Past 18 Months", "Total Gifts (All Time)"], ascending=False)
-    frequent_donors = sorted_donations[:n].copy()
-    frequent_donors["Total Gifts (All Time)"] = frequent_donors["Total Gifts (All Time)"].apply(lambda x: '${:,.2f}'.format(x))
-    frequent_donors["Last Gift Date"] = frequent_donors["Last Gift Date"].dt.date
-    frequent_donors["Number of Gifts Past 18 Months"] = frequent_donors["Number of Gifts Past 18 Months"].astype(int)
-    frequent_donors.reset_index(drop=True, inplace=True)
-    return frequent_donors[["Account ID", "City", "State", "Total Gifts (All Time)", "Last Gift Date", "Number of Gifts Past 18 Months"]]
+    positions = top_positions([df["Number of Gifts Past 18 Months"], df["Total Gifts (All Time)"]], offset + n)[offset:]
+    return donor_rows(df, positions)
 
 # stats by location
 
+# location index of each dataframe, built once and reused by the lookups below
+_location_indexes = {}
+
+def _group_positions(codes: np.ndarray) -> dict:
+    '''
+    returns {code: sorted row positions} for non-negative integer codes
+    '''
+    order = np.argsort(codes, kind="stable")
+    sorted_codes = codes[order]
+    bounds = np.flatnonzero(np.diff(sorted_codes)) + 1
+    groups = np.split(order, bounds)
+    return {int(codes[g[0]]): g for g in groups if len(g) and codes[g[0]] >= 0}
+
+@timed
+def location_index(df: pd.DataFrame) -> dict:
+    '''
+    returns an index from locations to row positions with keys
+        state: {state: positions},
+        city: {(lowercase city, state): positions},
+        unique cities: number of unique cities ignoring case, counting missing as one
+    the index is built once per dataframe, dataframes are treated as read-only after cleaning
+    '''
+    entry = _location_indexes.get(id(df))
+    if entry is not None and entry[0]() is df and entry[1]["rows"] == len(df):
+        return entry[1]
+
+    state_codes, states = pd.factorize(df["State"])
+    city_codes, cities = pd.factorize(df["City"])
+    lower_codes, lower_cities = pd.factorize(pd.Index(cities.astype("string")).str.lower())
+    city_codes = np.where(city_codes >= 0, np.append(lower_codes, -1)[city_codes], -1)
+
+    # cities are keyed together with their state
+    both = (city_codes >= 0) & (state_codes >= 0)
+    pair_codes = np.where(both, city_codes.astype("int64") * max(len(states), 1) + state_codes, -1)
+
+    index = {
+        "rows" : len(df),
+        "state" : {states[code]: positions for code, positions in _group_positions(state_codes).items()},
+        "city" : {(lower_cities[code // max(len(states), 1)], states[code % max(len(states), 1)]): positions
+                  for code, positions in _group_positions(pair_codes).items()},
+        "unique cities" : len(np.unique(city_codes[city_codes >= 0])) + int((city_codes < 0).any())
+    }
+    key = id(df)
+    _location_indexes[key] = (weakref.ref(df, lambda _: _location_indexes.pop(key, None)), index)
+    return index
+
+@timed
 def state_donations(df: pd.DataFrame, state: str) -> pd.DataFrame:
     '''
     returns subset of the data with donations in the given state
     '''
-    return df[df["State"] == state.upper()]
+    positions = location_index(df)["state"].get(state.upper(), [])
+    return df.iloc[positions]
 
+@timed
 def city_donations(df: pd.DataFrame, city: str, state: str) -> pd.DataFrame:
     '''
     returns subset of the data with donations in the given city and state
     '''
-    return df[(df["City"].str.lower() == str(city).lower()) & (df["State"] == state.upper())]
+    positions = location_index(df)["city"].get((str(city).lower(), state.upper()), [])
+    return df.iloc[positions]
 
+@timed
 def unique_cities(df: pd.DataFrame) -> int:
     '''
     returns the number of unique cities in the dataframe
     '''
-    return len(df["City"].str.lower().unique())
+    return location_index(df)["unique cities"]
+
+def blank_to_null(values: pd.Series) -> pd.Series:
+    '''
+    returns string values with empty strings replaced by nulls
+    '''
+    values = values.astype("string")
+    return values.mask(values.eq("").fillna(False))
+
+@timed
+def location_rollup(df: pd.DataFrame) -> pd.DataFrame:
+    '''
+    rolls the data up to one row per city and state with columns
+        number of donors,
+        total donation amount in cents,
+        donations in the past 18 months
+    rows without a state are left out, rows without a city are kept under an empty city
+    so that state totals still include them
+    '''
+    state = blank_to_null(df["State"])
+    keep = state.notna().to_numpy()
+    data = pd.DataFrame({
+        "City" : blank_to_null(df["City"]).fillna("")[keep],
+        "State" : state[keep],
+        "Donors" : df["Account ID"].notna()[keep].astype("int64"),
+        "Total Cents" : donations_cents(df)[keep],
+        "Gifts" : df["Number of Gifts Past 18 Months"][keep].fillna(0).astype("int64")
+    })
+    return data.groupby(["City", "State"]).sum()
+
+@timed
+def update_rollup(rollup: pd.DataFrame, before: pd.DataFrame, after: pd.DataFrame) -> pd.DataFrame:
+    '''
+    updates a location rollup for changed rows without regrouping the whole dataset
+    before holds the changed rows as they were, after holds them as they are now including new rows
+    '''
+    delta = location_rollup(after).sub(location_rollup(before), fill_value=0)
+    rollup = rollup.add(delta, fill_value=0).astype("int64")
+    return rollup[rollup["Donors"] > 0].sort_index()
 
-def stats_by_state(df: pd.DataFrame) -> pd.DataFrame:
+@timed
+def stats_by_state(df: pd.DataFrame, rollup: pd.DataFrame = None) -> pd.DataFrame:
     '''
     returns a dataframe where index is state abbreviations, columns are
         number of donors,
@@ -163,18 +565,19 @@ def stats_by_state(df: pd.DataFrame) -> pd.DataFrame:
         total donation amount,
         donations in the past 18 months,
         most recent donation date
+    reads from the location rollup, which is built from df if it is not given
     '''
-    # copy data and drop rows where there is no state
-    df["State"] = df["State"].replace("", np.nan)
-    data = df.copy().dropna(subset=["State"])
+    if rollup is None:
+        rollup = location_rollup(df)
 
-    # group by city and create dataframe
-    g = data.groupby("State")
+    # group the city rows of the rollup by state
+    cities = rollup.index.get_level_values("City") != ""
+    g = rollup.groupby(level="State")
     res = pd.DataFrame({
-        "Cities" : g["City"].nunique(),
-        "Donors" : g["Account ID"].nunique(),
-        "Total Gifts (All Time)" : g["Total Gifts (All Time)"].sum(),
-        "Number of Gifts Past 18 Months" : g["Number of Gifts Past 18 Months"].sum().astype(int)
+        "Cities" : pd.Series(cities.astype("int64"), index=rollup.index).groupby(level="State").sum(),
+        "Donors" : g["Donors"].sum(),
+        "Total Gifts (All Time)" : g["Total Cents"].sum(),
+        "Number of Gifts Past 18 Months" : g["Gifts"].sum().astype(int)
     })
 
     # remove canada
@@ -183,10 +586,11 @@ def stats_by_state(df: pd.DataFrame) -> pd.DataFrame:
 
     # sort and format
     res = res.sort_values(by=["Donors", "Total Gifts (All Time)", "State"], ascending=[False, False, True])
-    res["Total Gifts (All Time)"] = res["Total Gifts (All Time)"].apply(lambda x: "${:,.2f}".format(x))
+    res["Total Gifts (All Time)"] = res["Total Gifts (All Time)"].apply(lambda x: "${:,.2f}".format(cents_to_dollars(x)))
     return res
 
-def stats_by_city(df: pd.DataFrame) -> pd.DataFrame:
+@timed
+def stats_by_city(df: pd.DataFrame, rollup: pd.DataFrame = None) -> pd.DataFrame:
     '''
     returns a dataframe where index is city name, columns are
         state,
@@ -194,24 +598,25 @@ def stats_by_city(df: pd.DataFrame) -> pd.DataFrame:
         total donation amount,
         donations in the past 18 months,
         most recent donation date
+    reads from the location rollup, which is built from df if it is not given
     '''
-    # copy data and drop rows where city or state are null
-    df = df.replace("", np.nan)
-    data =  df.copy().dropna(subset=["City", "State"])
+    if rollup is None:
+        rollup = location_rollup(df)
 
-    # group by city and state and create dataframe
-    g = data.groupby(["City", "State"])
+    # city rows of the rollup
+    data = rollup[rollup.index.get_level_values("City") != ""]
     res = pd.DataFrame({
-        "Donors" : g["Account ID"].nunique(),
-        "Total Gifts (All Time)" : g["Total Gifts (All Time)"].sum(),
-        "Number of Gifts Past 18 Months" : g["Number of Gifts Past 18 Months"].sum().astype(int)
+        "Donors" : data["Donors"],
+        "Total Gifts (All Time)" : data["Total Cents"],
+        "Number of Gifts Past 18 Months" : data["Gifts"].astype(int)
     })
 
     # sort and format
     res = res.sort_values(by=["Donors", "Total Gifts (All Time)"], ascending=False)
-    res["Total Gifts (All Time)"] = res["Total Gifts (All Time)"].apply(lambda x: "${:,.2f}".format(x))
+    res["Total Gifts (All Time)"] = res["Total Gifts (All Time)"].apply(lambda x: "${:,.2f}".format(cents_to_dollars(x)))
     return res
 
+@timed
 def stats_no_location(df: pd.DataFrame) -> pd.DataFrame:
     '''
     returns a dataframe with rows that have country only or no location info, columns are
@@ -237,21 +642,153 @@ def stats_no_location(df: pd.DataFrame) -> pd.DataFrame:
     res["Total Gifts (All Time)"] = res["Total Gifts (All Time)"].apply(lambda x: "${:,.2f}".format(x))
     return res
 
+# stats by tier
+
+def _tier_summary(tiers: pd.Series, cents: np.ndarray) -> pd.DataFrame:
+    '''
+    donors, share of donors and total donated per tier, with bincount over the category codes
+    '''
+    codes = tiers.cat.codes.to_numpy()
+    keep = codes >= 0
+    k = len(tiers.cat.categories)
+    donors = np.bincount(codes[keep], minlength=k)
+    totals = np.bincount(codes[keep], weights=cents[keep], minlength=k)
+    res = pd.DataFrame({
+        "Donors" : donors,
+        "Share of Donors" : np.round(donors / max(donors.sum(), 1) * 100, 2),
+        "Total Gifts (All Time)" : ["${:,.2f}".format(cents_to_dollars(x)) for x in totals]
+    }, index=pd.Index(tiers.cat.categories, name="Tier"))
+    return res
+
+@timed
+def stats_by_tier(df: pd.DataFrame, schemes: dict = SCHEMES) -> pd.DataFrame:
+    '''
+    returns a dataframe indexed by scheme and tier with columns
+        number of donors,
+        share of donors in percent,
+        total donation amount
+    every scheme is evaluated in the same pass over the donation amounts
+    '''
+    tiers = tier_many(df["Total Gifts (All Time)"], schemes)
+    cents = donations_cents(df)
+    return pd.concat({name : _tier_summary(tiers[name], cents) for name in schemes}, names=["Scheme"])
+
+@timed
+def stats_by_rfm(df: pd.DataFrame, as_of=None) -> pd.DataFrame:
+    '''
+    returns donors, share of donors and total donation amount per recency x amount segment
+    recency is measured up to as_of, today by default
+    '''
+    res = _tier_summary(rfm_segments(df, as_of), donations_cents(df))
+    return res.rename_axis("Segment")
+
 # stats by time
 
-def stats_by_year(df: pd.DataFrame) -> pd.DataFrame:
+@timed
+def date_histogram(df: pd.DataFrame) -> pd.Series:
+    '''
+    counts donors by the day of their last gift, one bincount over day ordinals
+    index is the day and only days with donors are kept, rows without a date or id are left out
+    year, month and window stats below are derived from it without rescanning rows
+    '''
+    days = pd.to_datetime(df["Last Gift Date"]).to_numpy(dtype="datetime64[ns]").astype("datetime64[D]")
+    keep = ~np.isnat(days) & df["Account ID"].notna().to_numpy()
+    ordinals = days[keep].astype("int64")
+    if len(ordinals) == 0:
+        return pd.Series([], index=pd.DatetimeIndex([], name="Day"), name="Donors", dtype="int64")
+    first = ordinals.min()
+    counts = np.bincount(ordinals - first)
+    nonzero = np.flatnonzero(counts)
+    index = pd.DatetimeIndex((nonzero + first).astype("datetime64[D]").astype("datetime64[ns]"), name="Day")
+    return pd.Series(counts[nonzero].astype("int64"), index=index, name="Donors")
+
+@timed
+def update_date_histogram(dates: pd.Series, before: pd.DataFrame, after: pd.DataFrame) -> pd.Series:
+    '''
+    updates a date histogram for changed rows without recounting the whole dataset
+    before holds the changed rows as they were, after holds them as they are now including new rows
+    '''
+    delta = date_histogram(after).sub(date_histogram(before), fill_value=0)
+    dates = dates.add(delta, fill_value=0).astype("int64")
+    return dates[dates > 0].sort_index().rename("Donors")
+
+@timed
+def stats_by_year(df: pd.DataFrame, dates: pd.Series = None) -> pd.DataFrame:
     '''
     returns a dataframe with year and number of donors who made their last donation in that year
+    reads from the date histogram, which is built from df if it is not given
     '''
-    g = df.groupby(df["Last Gift Date"].dt.year.rename("Year"))
-    res = pd.DataFrame({"Donors" : g["Account ID"].nunique()})
+    if dates is None:
+        dates = date_histogram(df)
+    res = pd.DataFrame({"Donors" : dates.groupby(dates.index.year.rename("Year")).sum()})
     return res
 
-def stats_by_month(df: pd.DataFrame) -> pd.DataFrame:
+@timed
+def stats_by_month(df: pd.DataFrame, dates: pd.Series = None) -> pd.DataFrame:
     '''
     returns a dataframe with month and number of donors who made their last donation in that month
+    every month is listed, months without donors have 0
     '''
-    g = df.groupby(df["Last Gift Date"].dt.month.rename("Month"))
-    res = pd.DataFrame({"Donors" : g["Account ID"].nunique()})
-    res.index = pd.Index(calendar.month_abbr[1:], name="Month")
+    if dates is None:
+        dates = date_histogram(df)
+    donors = dates.groupby(dates.index.month).sum().reindex(range(1, 13), fill_value=0)
+    res = pd.DataFrame({"Donors" : donors.to_numpy()}, index=pd.Index(calendar.month_abbr[1:], name="Month"))
     return res
+
+@timed
+def stats_by_period(df: pd.DataFrame, freq: str = "M", dates: pd.Series = None) -> pd.DataFrame:
+    '''
+    returns a dataframe with calendar periods and number of donors who made their last donation in each
+    freq is a pandas period alias, e.g. "Y", "Q", "M" or "W", periods without donors have 0
+    '''
+    if dates is None:
+        dates = date_histogram(df)
+    periods = dates.index.to_period(freq)
+    donors = dates.groupby(periods).sum()
+    if len(donors):
+        donors = donors.reindex(pd.period_range(periods.min(), periods.max(), freq=freq), fill_value=0)
+    res = pd.DataFrame({"Donors" : donors})
+    res.index.name = "Period"
+    return res
+
+def _donors_before(dates: pd.Series, days) -> np.ndarray:
+    '''
+    number of donors whose last gift was on or before each of the given days
+    '''
+    cumulative = np.r_[0, dates.to_numpy().cumsum()]
+    return cumulative[dates.index.searchsorted(pd.DatetimeIndex(days), side="right")]
+
+def window_donors(dates: pd.Series, months: int = 18, as_of=None) -> int:
+    '''
+    number of donors whose last gift was within the given months up to as_of, today by default
+    donors outside the window are lapsed
+    '''
+    end = pd.Timestamp(as_of if as_of is not None else pd.Timestamp.today()).normalize()
+    start = end - pd.DateOffset(months=months)
+    before = _donors_before(dates, [start, end])
+    return int(before[1] - before[0])
+
+@timed
+def lapsed_donors(dates: pd.Series, months: int = 18, as_of=None) -> pd.DataFrame:
+    '''
+    returns a one row dataframe with the number of donors whose last gift was within the given months up to as_of
+    and the number of lapsed donors whose last gift was before them
+    '''
+    end = pd.Timestamp(as_of if as_of is not None else pd.Timestamp.today()).normalize()
+    active = window_donors(dates, months, end)
+    lapsed = int(_donors_before(dates, [end - pd.DateOffset(months=months)])[0])
+    return pd.DataFrame({"Active Donors" : [active], "Lapsed Donors" : [lapsed]}, index=pd.Index([end], name="As Of"))
+
+@timed
+def rolling_donors(dates: pd.Series, months: int = 18, freq: str = "M") -> pd.DataFrame:
+    '''
+    returns a dataframe with the end of each period and the number of donors whose last gift was
+    within the given months before it, e.g. how many donors were still active at the end of each month
+    '''
+    if len(dates) == 0:
+        return pd.DataFrame({"Donors" : pd.Series([], dtype="int64")}, index=pd.PeriodIndex([], freq=freq, name="Period"))
+    periods = pd.period_range(dates.index.min(), dates.index.max(), freq=freq, name="Period")
+    ends = periods.end_time.normalize()
+    starts = ends - pd.DateOffset(months=months)
+    donors = _donors_before(dates, ends) - _donors_before(dates, starts)
+    return pd.DataFrame({"Donors" : donors}, index=periods)
@@ -0,0 +1,86 @@
+import os
+import pandas as pd
+from modules.merge_csv import normalize_locations
+from modules.data_analysis import clean, location_rollup, date_histogram
+from modules import segments, sketches, storage
+
+# legacy csv export and the typed dataset it was migrated to before the segment store
+PATH = "donor_data.csv"
+DATA_PATH = storage.dataset_path("donor_data")
+STORE_PATH = "donor_store"
+ROLLUP_PATH = storage.dataset_path("donor_rollup")
+DATES_PATH = storage.dataset_path("donor_dates")
+SKETCHES_PATH = "donor_sketches.npz"
+
+# load the current version of the data from the segment store
+# the store is created on first use from the typed dataset or the legacy csv, or empty if neither exists
+# the legacy csv is migrated to the typed dataset on the way
+def load_data(columns=None):
+    if not segments.exists(STORE_PATH):
+        if os.path.exists(DATA_PATH):
+            df = storage.read(DATA_PATH)
+        elif os.path.exists(PATH) and os.path.getsize(PATH) > 1:
+            df = storage.migrate(PATH, DATA_PATH, convert=lambda df: clean(normalize_locations(df)))
+        else:
+            df = pd.DataFrame()
+        segments.init(STORE_PATH, df)
+    return segments.materialize(STORE_PATH, columns=columns)
+
+# save the rows an upload changed as a new version, compacting older versions in the background
+# df_old is the data before the upload, df the data after it and changed the rows it touched
+def save_data(df_old, df, changed):
+    version = segments.append(STORE_PATH, df_old, changed)
+    segments.maybe_compact(STORE_PATH, df, version)
+    return version
+
+# roll the data back to an earlier version, returns the data and the rows it changed before and after
+def rollback_data(df, version):
+    return segments.rollback(STORE_PATH, df, version)
+
+# versions of the data, newest last
+def data_history():
+    return segments.history(STORE_PATH)
+
+# time the current version of the data was saved
+def data_modified():
+    return segments.modified(STORE_PATH)
+
+# load the location rollup of the dataset, rebuilding it if it is missing or older than the dataset
+def load_rollup(df):
+    if os.path.exists(ROLLUP_PATH) and os.path.getmtime(ROLLUP_PATH) >= data_modified():
+        rollup = storage.read(ROLLUP_PATH).astype({"City": "string", "State": "string"})
+        return rollup.set_index(["City", "State"])
+    rollup = location_rollup(df)
+    save_rollup(rollup)
+    return rollup
+
+# save the location rollup alongside the dataset
+def save_rollup(rollup):
+    storage.write(rollup.reset_index(), ROLLUP_PATH)
+
+# load the last gift date histogram of the dataset, rebuilding it if it is missing or older than the dataset
+def load_dates(df):
+    if os.path.exists(DATES_PATH) and os.path.getmtime(DATES_PATH) >= data_modified():
+        dates = storage.read(DATES_PATH)
+        return dates.set_index(pd.DatetimeIndex(dates["Day"], name="Day"))["Donors"]
+    dates = date_histogram(df)
+    save_dates(dates)
+    return dates
+
+# save the date histogram alongside the dataset
+def save_dates(dates):
+    storage.write(dates.reset_index(), DATES_PATH)
+
+# load the segment sketches of the dataset, rebuilding them if they are missing or older than the dataset
+def load_sketches(df):
+    if os.path.exists(SKETCHES_PATH) and os.path.getmtime(SKETCHES_PATH) >= data_modified():
+        return sketches.load_sketches(SKETCHES_PATH)
+    sketch = sketches.sketch_partials(df)
+    save_sketches(sketch)
+    return sketch
+
+# save the segment sketches alongside the dataset, written then renamed like the other files
+def save_sketches(sketch):
+    tmp = SKETCHES_PATH + ".tmp"
+    sketches.save_sketches(sketch, tmp)
+    os.replace(tmp, SKETCHES_PATH)
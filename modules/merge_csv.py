@@ -1,9 +1,106 @@
+import weakref
+import numpy as np
 import pandas as pd
+from modules.perf import timed
 
+COLUMNS = ["Account ID", "City", "State",
+           "BFPO No", "Postcode", "Country",
+           "Total Gifts (All Time)", "Last Gift Date",
+           "Number of Gifts Past 18 Months"]
+
+# columns clean derives from the total, updated along with it
+DERIVED = ["Total Gifts Cents", "Category"]
+
+# Account ID index of each merged dataset, kept between merges so a merge only looks up the uploaded ids
+_indexes = {}
+
+def _remember(df: pd.DataFrame, index: pd.Index) -> None:
+    key = id(df)
+    _indexes[key] = (weakref.ref(df, lambda _: _indexes.pop(key, None)), index)
+
+def account_index(df: pd.DataFrame) -> pd.Index:
+    '''
+    returns an index of the dataframe's Account IDs by row position
+    the index is built once per dataframe and reused by later merges
+    '''
+    entry = _indexes.get(id(df))
+    if entry is not None and entry[0]() is df and len(entry[1]) == len(df):
+        return entry[1]
+    index = pd.Index(df["Account ID"])
+    _remember(df, index)
+    return index
+
+def with_columns(df: pd.DataFrame) -> pd.DataFrame:
+    '''
+    returns the dataframe with every merged column, missing ones filled with nulls, followed by its own extra columns
+    '''
+    return df.reindex(columns=list(dict.fromkeys(COLUMNS + list(df.columns))))
+
+def touched_rows(df: pd.DataFrame, df_new: pd.DataFrame) -> pd.DataFrame:
+    '''
+    returns the rows of df whose Account ID appears in df_new, found through the account index
+    every row of an id is returned if df holds it more than once
+    '''
+    if df.empty:
+        return with_columns(df_new.iloc[:0])
+    index = account_index(df)
+    ids = df_new["Account ID"].drop_duplicates()
+    positions = index.get_indexer(ids) if index.is_unique else index.get_indexer_non_unique(ids)[0]
+    return df.iloc[np.sort(positions[positions >= 0])]
+
+def normalize_locations(df: pd.DataFrame) -> pd.DataFrame:
+    '''
+    makes string columns uniform casing
+    categorical columns were interned by clean with uniform casing already and are kept as they are
+    '''
+    def plain(col):
+        return col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype)
+    if plain("City"):
+        df["City"] = df["City"].str.title()
+    if plain("State"):
+        df["State"] = df["State"].str.upper()
+    if plain("Country"):
+        df["Country"] = df["Country"].str.title()
+    return df
+
+def _updated(current: pd.Series, positions: np.ndarray, values: pd.Series) -> pd.Series:
+    '''
+    returns the column with the given row positions set to values, widening its type if needed
+    '''
+    if isinstance(current.dtype, pd.CategoricalDtype):
+        added = pd.Index(values.dropna().unique()).difference(current.cat.categories)
+        if len(added):
+            current = current.cat.add_categories(added)
+        values = values.astype(object)
+    elif current.dtype != values.dtype:
+        try:
+            dtype = np.result_type(current.dtype, values.dtype)
+        except TypeError:
+            dtype = object
+        current = current.astype(dtype)
+    current = current.copy()
+    current.iloc[positions] = values.to_numpy()
+    return current
+
+def _appended(df: pd.DataFrame, rows: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    '''
+    returns the dataframe and the rows to append to it with matching columns
+    categorical columns of the dataframe gain the new values as categories so that concat keeps them categorical
+    '''
+    rows = rows.reindex(columns=df.columns)
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            added = pd.Index(rows[col].dropna().unique()).difference(df[col].cat.categories)
+            if len(added):
+                df[col] = df[col].cat.add_categories(added)
+            rows[col] = rows[col].astype(df[col].dtype)
+    return df, rows
+
+@timed
 def merge_csv(df_old: pd.DataFrame, df_new: pd.DataFrame, save=True) -> tuple[pd.DataFrame, pd.DataFrame]:
     '''
     takes old csv filepath and updated csv filepath, merges into one dataframe, saves as a csv, and returns the merged dataframe \n
-    columns of csvs should be 
+    columns of csvs should be
         Account ID,
         City,
         State,
@@ -13,47 +110,59 @@ def merge_csv(df_old: pd.DataFrame, df_new: pd.DataFrame, save=True) -> tuple[pd
         Total Gifts (All Time),
         Last Gift Date
         Number of Gifts Past 18 Months
-    and any column except Account ID can appear in only one csv
+    and any column except Account ID can appear in only one csv \n
+    rows of the new dataframe are upserted by Account ID: matched rows take every non-null new value
+    and unmatched rows are appended, so the work done grows with the size of the new dataframe
     '''
 
-    # if the old df is empty, just return the new one
+    # the last row for an id in the new dataset wins, and only new rows need uniform casing
+    df_new = df_new.drop_duplicates(subset="Account ID", keep="last")
+    df_new = normalize_locations(df_new.copy())
+
+    # if the old df is empty, just return the new one with every column, so partial uploads keep the schema
     if df_old.empty:
+        df_new = with_columns(df_new).reset_index(drop=True)
         return df_new, df_new
 
     # make sure dataframe columns match
     df_old.rename(columns={"Total Gifts Amount": "Total Gifts (All Time)"}, inplace=True)
 
+    # look up the row of each new id in the old dataset
+    index = account_index(df_old)
+    if not index.is_unique:
+        df_old = df_old.drop_duplicates(subset="Account ID", keep="last").reset_index(drop=True)
+        index = account_index(df_old)
+    positions = index.get_indexer(df_new["Account ID"])
+    matched = positions >= 0
+
     # display number of shared rows and rows unique to each dataset
-    shared = list(set(df_old["Account ID"]).intersection(set(df_new["Account ID"])))
-    df1_unique = df_old[~df_old["Account ID"].isin(shared)]
-    df2_unique = df_new[~df_new["Account ID"].isin(shared)]
-    rows = (len(shared), df1_unique.shape[0], df2_unique.shape[0])
+    df2_unique = df_new[~matched]
+    rows = (int(matched.sum()), len(df_old) - int(matched.sum()), df2_unique.shape[0])
     print(f"Merging {rows[0]} shared rows, {rows[1]} rows unique to old dataset, and {rows[2]} rows unique to new dataset.")
 
-    # outer merge on account id
-    df_merged = df_old.merge(df_new, on="Account ID", how="outer")
-
-    # remove duplicate columns by taking the value from the new dataframe
-    # if the value is null in the new dataframe, take the value from the old dataframe
-    for col in df_merged.columns:
-        if col.endswith("_x"):
-            base = col[:-2]
-            y_col = base + "_y"
-            if y_col in df_merged.columns:
-                df_merged[base] = df_merged[y_col].combine_first(df_merged[col])
-                df_merged = df_merged.drop(columns=[col, y_col])
-
-    # reorder columns
-    col_order = ["Account ID", "City", "State", 
-                 "BFPO No", "Postcode", "Country", 
-                 "Total Gifts (All Time)", "Last Gift Date", 
-                 "Number of Gifts Past 18 Months"]
-    df_merged = df_merged[col_order]
-
-    # make sure string columns are in uniform casing
-    df_merged["City"] = df_merged["City"].str.title()
-    df_merged["State"] = df_merged["State"].str.upper()
-    df_merged["Country"] = df_merged["Country"].str.title()
+    # update shared rows by taking the value from the new dataframe
+    # if the value is null in the new dataframe, keep the value from the old dataframe
+    # columns the old dataframe has beyond COLUMNS are kept, so a cleaned dataset stays cleaned
+    df_merged = with_columns(df_old)
+    for col in COLUMNS[1:]:
+        if col in df_new.columns:
+            take = matched & df_new[col].notna().to_numpy()
+            if take.any():
+                df_merged[col] = _updated(df_merged[col], positions[take], df_new[col][take])
+
+    # derived columns are taken wherever the total is
+    if "Total Gifts (All Time)" in df_new.columns:
+        take = matched & df_new["Total Gifts (All Time)"].notna().to_numpy()
+        for col in DERIVED:
+            if col in df_merged.columns and col in df_new.columns and take.any():
+                df_merged[col] = _updated(df_merged[col], positions[take], df_new[col][take])
+
+    # append rows unique to the new dataframe
+    if len(df2_unique):
+        df_merged, appended = _appended(df_merged, df2_unique)
+        df_merged = pd.concat([df_merged, appended], ignore_index=True)
+        index = index.append(pd.Index(df2_unique["Account ID"]))
+    _remember(df_merged, index)
 
     if save:
         # convert merged dataframe to csv
@@ -62,4 +171,38 @@ def merge_csv(df_old: pd.DataFrame, df_new: pd.DataFrame, save=True) -> tuple[pd
         # convert new rows to csv
         df2_unique.to_csv("new_data.csv", index=False)
 
-    return df_merged, df2_unique
\ No newline at end of file
+    return df_merged, df2_unique
+
+@timed
+def merge_csv_chunks(df_old: pd.DataFrame, chunks, progress=None, on_change=None) -> tuple[pd.DataFrame, pd.DataFrame]:
+    '''
+    merges an iterable of new dataframe chunks into the old dataframe one chunk at a time
+    with merge_csv semantics, so only one chunk of the new data is held in memory \n
+    progress is called with the number of new rows merged so far after each chunk
+    on_change is called with the rows each chunk touched before and after merging it,
+    so indexes derived from the dataset can be updated with only the changed rows
+    returns the merged dataframe and the rows that were not in the old dataframe
+    '''
+    df_merged = df_old
+
+    # merge_csv keeps the last row of an id the old dataframe holds more than once,
+    # drop the others up front so on_change hears about them too
+    if not df_merged.empty and not account_index(df_merged).is_unique:
+        dropped = df_merged[df_merged["Account ID"].duplicated(keep=False)]
+        df_merged = df_merged.drop_duplicates(subset="Account ID", keep="last").reset_index(drop=True)
+        if on_change is not None:
+            on_change(dropped, touched_rows(df_merged, dropped))
+    start = len(df_merged)
+
+    done = 0
+    for chunk in chunks:
+        before = touched_rows(df_merged, chunk) if on_change is not None else None
+        df_merged, _ = merge_csv(df_merged, chunk, save=False)
+        if on_change is not None:
+            on_change(before, touched_rows(df_merged, chunk))
+        done += len(chunk)
+        if progress is not None:
+            progress(done)
+
+    # appended rows always come after the old rows
+    return df_merged, df_merged.iloc[start:]
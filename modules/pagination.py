@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+
+from modules.perf import timed
+
+# rows sent to the browser per page
+PAGE_SIZE = 50
+
+def _column(df: pd.DataFrame, name: str) -> pd.Series:
+    '''
+    returns a column by name, or the index if it has that name
+    '''
+    if name in df.columns:
+        return df[name]
+    return df.index.get_level_values(name).to_series(index=df.index)
+
+def sort_key(values: pd.Series) -> pd.Series:
+    '''
+    returns values to sort a column by, formatted amounts like "$1,234.56" sort as numbers
+    '''
+    if pd.api.types.is_numeric_dtype(values) or pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    text = values.astype("string")
+    numbers = pd.to_numeric(text.str.replace(r"[$,]", "", regex=True), errors="coerce")
+    if numbers.notna().sum() == text.notna().sum():
+        return numbers
+    return text.str.lower()
+
+@timed
+def filter_positions(df: pd.DataFrame, query: str) -> np.ndarray:
+    '''
+    returns the positions of rows where any column or index value contains the query, ignoring case
+    '''
+    if not query:
+        return np.arange(len(df))
+    match = np.zeros(len(df), dtype=bool)
+    names = [name for name in df.index.names if name is not None] + list(df.columns)
+    for name in names:
+        values = _column(df, name)
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            # match each distinct value once and map rows to it by code
+            found = values.cat.categories.astype("string").str.contains(query, case=False, regex=False)
+            codes = values.cat.codes.to_numpy()
+            match |= np.append(np.asarray(found, dtype=bool), False)[codes]
+        else:
+            match |= values.astype("string").str.contains(query, case=False, regex=False).fillna(False).to_numpy(dtype=bool)
+    return np.flatnonzero(match)
+
+@timed
+def view_positions(df: pd.DataFrame, query: str = "", sort: str = None, ascending: bool = True) -> np.ndarray:
+    '''
+    returns the row positions of df filtered by query and ordered by the sort column
+    ties keep their row order and missing values come last
+    '''
+    positions = filter_positions(df, query)
+    if sort is None or len(positions) == 0:
+        return positions
+    key = sort_key(_column(df, sort).iloc[positions]).reset_index(drop=True)
+    order = key.sort_values(ascending=ascending, kind="stable", na_position="last").index.to_numpy()
+    return positions[order]
+
+def page_count(rows: int, size: int = PAGE_SIZE) -> int:
+    return max((rows + size - 1) // size, 1)
+
+def page(df: pd.DataFrame, positions: np.ndarray, number: int, size: int = PAGE_SIZE) -> pd.DataFrame:
+    '''
+    returns page number (from 1) of the rows at positions
+    '''
+    start = (number - 1) * size
+    return df.iloc[positions[start:start + size]]
@@ -0,0 +1,61 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from modules import data_analysis
+from modules.perf import timed
+
+# worker processes used when RIVERKEEPER_WORKERS is set, parallel aggregation is off without it
+WORKERS = int(os.environ.get("RIVERKEEPER_WORKERS", "0") or 0)
+ENABLED = WORKERS > 1
+
+# process pools by worker count, started on first use and reused afterwards
+_pools = {}
+
+def shards(df: pd.DataFrame, n: int, columns: list) -> list:
+    '''
+    splits the given columns of the dataframe into n shards by the factorized code of Account ID
+    every donor lands in exactly one shard, so per-donor distinct counts of shards add up exactly
+    shards carry the codes in place of the ids, which are cheaper to send to the workers
+    '''
+    codes = pd.factorize(df["Account ID"])[0]
+    data = df[columns].assign(**{"Account ID" : pd.arrays.IntegerArray(codes, codes < 0)})
+    shard = codes % n
+    return [data[shard == i] for i in range(n)]
+
+def _map(fn, df: pd.DataFrame, columns: list, workers: int) -> list:
+    '''
+    runs fn on each shard in a process pool and returns the partial results
+    '''
+    workers = workers or WORKERS or os.cpu_count()
+    if workers not in _pools:
+        _pools[workers] = ProcessPoolExecutor(max_workers=workers)
+    return list(_pools[workers].map(fn, shards(df, workers, columns)))
+
+@timed
+def segment_stats(df: pd.DataFrame, workers: int = None) -> pd.DataFrame:
+    '''
+    data_analysis.segment_stats computed from per-shard value histograms in worker processes
+    '''
+    columns = ["Account ID", "Number of Gifts Past 18 Months", "Total Gifts (All Time)", "Total Gifts Cents"]
+    partials = _map(data_analysis.segment_partials, df, columns, workers)
+    return data_analysis.segment_table(data_analysis.merge_segment_partials(partials))
+
+def basic_stats(df: pd.DataFrame, workers: int = None) -> pd.DataFrame:
+    return data_analysis.basic_stats(df, segment_stats(df, workers))
+
+@timed
+def location_rollup(df: pd.DataFrame, workers: int = None) -> pd.DataFrame:
+    '''
+    data_analysis.location_rollup computed per shard in worker processes and added up
+    '''
+    columns = ["Account ID", "City", "State", "Total Gifts Cents", "Number of Gifts Past 18 Months"]
+    partials = _map(data_analysis.location_rollup, df, columns, workers)
+    return pd.concat(partials).groupby(level=["City", "State"]).sum()
+
+def stats_by_state(df: pd.DataFrame, workers: int = None) -> pd.DataFrame:
+    return data_analysis.stats_by_state(df, location_rollup(df, workers))
+
+def stats_by_city(df: pd.DataFrame, workers: int = None) -> pd.DataFrame:
+    return data_analysis.stats_by_city(df, location_rollup(df, workers))
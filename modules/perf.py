@@ -0,0 +1,144 @@
+import contextlib
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+import pandas as pd
+
+# instrumentation is off unless RIVERKEEPER_PERF is set or enable() is called
+ENABLED = os.environ.get("RIVERKEEPER_PERF", "") not in ("", "0")
+
+# most recent timings kept in memory
+MAX_RECORDS = 2000
+
+logger = logging.getLogger("riverkeeper.perf")
+
+_records = deque(maxlen=MAX_RECORDS)
+_stack = threading.local()
+
+# open sections of every thread, tracemalloc's peak is process wide so it only belongs
+# to a section if no other thread (another session) had a section open at the same time
+_open = {}
+_open_lock = threading.Lock()
+
+def enabled() -> bool:
+    return ENABLED
+
+def enable(on: bool = True) -> None:
+    '''
+    turns instrumentation on or off for the whole process
+    '''
+    global ENABLED
+    ENABLED = on
+    if not on and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+@contextlib.contextmanager
+def section(name: str, rows: int = None):
+    '''
+    records wall time, peak memory above the starting point and input rows of the enclosed code
+    the peak is left empty if a section ran in another thread meanwhile, as it may hold that thread's memory
+    does nothing when instrumentation is disabled
+    '''
+    if not ENABLED:
+        yield
+        return
+
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    stack = getattr(_stack, "frames", None)
+    if stack is None:
+        stack = _stack.frames = []
+
+    thread = threading.get_ident()
+    with _open_lock:
+        # resetting the peak for this section would lose the enclosing section's peak, so carry it over
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1]["peak"] = max(stack[-1]["peak"], peak)
+        others = [frames for other, frames in _open.items() if other != thread and frames]
+        frame = {"start" : current, "peak" : current, "shared" : bool(others)}
+        if others:
+            # another thread's sections are running, neither side's peak can be told apart any more
+            for frames in others + [stack]:
+                for f in frames:
+                    f["shared"] = True
+        else:
+            tracemalloc.reset_peak()
+        stack.append(frame)
+        _open[thread] = stack
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        with _open_lock:
+            stack.pop()
+            if not stack:
+                _open.pop(thread, None)
+            peak = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+            if stack:
+                stack[-1]["peak"] = max(stack[-1]["peak"], peak)
+        record = {
+            "name" : name,
+            "seconds" : seconds,
+            "peak_mb" : float("nan") if frame["shared"] else (peak - frame["start"]) / 1024 ** 2,
+            "rows" : rows,
+            "depth" : len(stack),
+            "time" : time.time(),
+        }
+        _records.append(record)
+        logger.debug(json.dumps(record))
+
+def _rows(args: tuple) -> int:
+    for arg in args:
+        if isinstance(arg, (pd.DataFrame, pd.Series)):
+            return len(arg)
+    return None
+
+def timed(fn):
+    '''
+    decorator recording each call of fn as a section named after it
+    when instrumentation is disabled the only overhead is one flag check per call
+    '''
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not ENABLED:
+            return fn(*args, **kwargs)
+        with section(f"{fn.__module__}.{fn.__qualname__}", _rows(args)):
+            return fn(*args, **kwargs)
+    return wrapper
+
+def records() -> pd.DataFrame:
+    '''
+    returns the recorded timings, most recent last
+    '''
+    return pd.DataFrame(list(_records), columns=["name", "seconds", "peak_mb", "rows", "depth", "time"])
+
+def summary() -> pd.DataFrame:
+    '''
+    returns recorded timings aggregated by name, slowest total first
+    '''
+    g = records().groupby("name")
+    res = pd.DataFrame({
+        "Calls" : g["seconds"].count(),
+        "Total Seconds" : g["seconds"].sum(),
+        "Mean Seconds" : g["seconds"].mean(),
+        "Max Peak MB" : g["peak_mb"].max(),
+        "Max Rows" : g["rows"].max()
+    })
+    return res.sort_values(by="Total Seconds", ascending=False)
+
+def export_json() -> str:
+    '''
+    returns the recorded timings as a json array
+    '''
+    return json.dumps(list(_records), indent=2)
+
+def clear() -> None:
+    _records.clear()
@@ -0,0 +1,33 @@
+import pandas as pd
+from modules.data_analysis import *
+
+# columns the report tables read, the rest of the dataset does not need to be loaded
+COLUMNS = ["Account ID", "City", "State", "Country", "Total Gifts (All Time)", "Total Gifts Cents",
+           "Last Gift Date", "Number of Gifts Past 18 Months"]
+
+def report_tables(data: pd.DataFrame, rollup: pd.DataFrame = None, n: int = 50, dates: pd.Series = None) -> dict:
+    '''
+    returns every table shown on the analytics page by name for the cleaned data
+    the location rollup and date histogram are built from data if they are not given
+    '''
+    segments = segment_stats(data)
+    if rollup is None:
+        rollup = location_rollup(data)
+    if dates is None:
+        dates = date_histogram(data)
+    return {
+        "basic_stats" : basic_stats(data, segments),
+        "active_donors" : active_donors(data, segments),
+        "inactive_donors" : inactive_donors(data, segments),
+        "top_donors" : top_donors(data, n),
+        "frequent_donors" : frequent_donors(data, n),
+        "stats_by_state" : stats_by_state(data, rollup),
+        "stats_by_city" : stats_by_city(data, rollup),
+        "stats_no_location" : stats_no_location(data),
+        "stats_by_year" : stats_by_year(data, dates),
+        "stats_by_month" : stats_by_month(data, dates),
+        "rolling_donors" : rolling_donors(dates),
+        "lapsed_donors" : lapsed_donors(dates),
+        "stats_by_tier" : stats_by_tier(data),
+        "stats_by_rfm" : stats_by_rfm(data),
+    }
@@ -0,0 +1,279 @@
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+
+from modules import storage
+from modules.merge_csv import account_index, touched_rows, _updated
+from modules.perf import timed
+
+# number of delta segments on top of the base before a compaction is started
+COMPACT_AFTER = 8
+
+MANIFEST = "manifest.json"
+
+# guards manifest updates between sessions and the compaction thread
+_lock = threading.Lock()
+_compacting = set()
+
+def exists(path: str) -> bool:
+    return os.path.exists(os.path.join(path, MANIFEST))
+
+def manifest(path: str) -> dict:
+    '''
+    returns the store's manifest:
+        version is the current version,
+        base is the compacted snapshot the view is rebuilt from and the version it holds,
+        versions lists every change with its delta files and the files that undo it
+    '''
+    with open(os.path.join(path, MANIFEST)) as f:
+        return json.load(f)
+
+def _write_manifest(path: str, m: dict) -> None:
+    # write then rename, so a crash never leaves a half written manifest
+    tmp = os.path.join(path, MANIFEST + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(m, f, indent=2)
+    os.replace(tmp, os.path.join(path, MANIFEST))
+
+def _file(kind: str, version: int) -> str:
+    return f"{kind}-{version:05d}{storage.DEFAULT_FORMAT}"
+
+def _write(path: str, name: str, df: pd.DataFrame) -> str:
+    if name is None or df.empty:
+        return None
+    storage.write(df, os.path.join(path, name))
+    return name
+
+def _read(path: str, name: str, columns: list = None) -> pd.DataFrame:
+    if name is None:
+        return pd.DataFrame()
+    return storage.read(os.path.join(path, name), columns)
+
+def _ids(df: pd.DataFrame) -> pd.Series:
+    return df["Account ID"] if "Account ID" in df.columns else pd.Series([], dtype=object)
+
+def init(path: str, df: pd.DataFrame) -> None:
+    '''
+    creates a store holding df as version 0
+    '''
+    os.makedirs(path, exist_ok=True)
+    now = time.time()
+    m = {
+        "version" : 0,
+        "time" : now,
+        "base" : {"version" : 0, "file" : _write(path, _file("base", 0), df)},
+        "versions" : [],
+    }
+    with _lock:
+        _write_manifest(path, m)
+
+def modified(path: str) -> float:
+    '''
+    time the current version was written, compaction does not change it
+    '''
+    return manifest(path)["time"]
+
+def history(path: str) -> pd.DataFrame:
+    '''
+    returns a dataframe with one row per version: when it was written, rows upserted and removed, and a note
+    '''
+    m = manifest(path)
+    rows = [{"Version" : 0, "Time" : None, "Upserted" : 0, "Removed" : 0, "Note" : "initial data"}]
+    for entry in m["versions"]:
+        rows.append({
+            "Version" : entry["version"],
+            "Time" : entry["time"],
+            "Upserted" : entry["upserted"],
+            "Removed" : entry["removed"],
+            "Note" : entry["note"]
+        })
+    res = pd.DataFrame(rows).set_index("Version")
+    res["Time"] = pd.to_datetime(res["Time"], unit="s")
+    return res
+
+@timed
+def apply_delta(df: pd.DataFrame, upserts: pd.DataFrame, removed: pd.Series = None) -> pd.DataFrame:
+    '''
+    returns df with the upsert rows replacing the rows of their Account ID, or appended if new,
+    and the rows of the removed Account IDs dropped
+    unlike merge_csv every value is replaced, null or not, so deltas replay and undo exactly
+    like merge_csv the last row of an Account ID wins when df or the upserts hold it more than once
+    '''
+    if not upserts.empty:
+        upserts = upserts.drop_duplicates(subset="Account ID", keep="last")
+    if df.empty:
+        df = upserts.reset_index(drop=True)
+    elif not upserts.empty:
+        if not account_index(df).is_unique:
+            df = df.drop_duplicates(subset="Account ID", keep="last").reset_index(drop=True)
+        positions = account_index(df).get_indexer(upserts["Account ID"])
+        matched = positions >= 0
+        res = df.copy()
+        for col in df.columns[df.columns.isin(upserts.columns)]:
+            if matched.any():
+                res[col] = _updated(res[col], positions[matched], upserts[col][matched])
+        if not matched.all():
+            res = pd.concat([res, upserts[~matched].reindex(columns=df.columns)], ignore_index=True)
+        df = res
+    if removed is not None and len(removed) and not df.empty:
+        df = df[~df["Account ID"].isin(removed)].reset_index(drop=True)
+    return df
+
+def _changed(upserts: pd.DataFrame, before: pd.DataFrame) -> pd.DataFrame:
+    '''
+    returns the upsert rows that differ from the stored row of their Account ID
+    '''
+    if before.empty:
+        return upserts
+    prior = before.drop_duplicates(subset="Account ID", keep="last").set_index("Account ID")
+    columns = [col for col in upserts.columns if col != "Account ID"]
+    new = upserts[columns].astype("string").reset_index(drop=True)
+    old = prior.reindex(index=upserts["Account ID"], columns=columns).astype("string").reset_index(drop=True)
+    same = ((new == old).fillna(False) | (new.isna() & old.isna())).all(axis=1).to_numpy()
+    same &= upserts["Account ID"].isin(prior.index).to_numpy()
+    return upserts[~same]
+
+@timed
+def append(path: str, current: pd.DataFrame, upserts: pd.DataFrame, removed: pd.Series = None, note: str = "upload") -> int:
+    '''
+    records a change to the current data as a new version and returns its number
+    only the changed rows are written: the upserted rows, the removed ids, and the rows
+    as they were before so the change can be undone, nothing is written if nothing changed
+    '''
+    removed = pd.Series([], dtype=object) if removed is None else pd.Series(removed)
+    if upserts.empty:
+        upserts = current.iloc[:0]
+    removed = removed[removed.isin(_ids(current))]
+    before = touched_rows(current, upserts)
+    upserts = _changed(upserts, before)
+    if upserts.empty and removed.empty:
+        return None
+
+    # rows to restore on undo, and ids to remove on undo because this change added them
+    touched = pd.DataFrame({"Account ID" : pd.concat([_ids(upserts), removed], ignore_index=True)})
+    before = touched_rows(current, touched)
+    added = _ids(upserts)[~_ids(upserts).isin(_ids(current))]
+
+    with _lock:
+        m = manifest(path)
+        version = m["version"] + 1
+        entry = {
+            "version" : version,
+            "time" : time.time(),
+            "upserted" : len(upserts),
+            "removed" : len(removed),
+            "note" : note,
+            "upserts" : _write(path, _file("upserts", version), upserts),
+            "removals" : _write(path, _file("removals", version), removed.to_frame("Account ID")),
+            "before" : _write(path, _file("before", version), before),
+            "added" : _write(path, _file("added", version), added.to_frame("Account ID")),
+        }
+        m["versions"].append(entry)
+        m["version"] = version
+        m["time"] = entry["time"]
+        _write_manifest(path, m)
+    return version
+
+@timed
+def materialize(path: str, version: int = None, columns: list = None) -> pd.DataFrame:
+    '''
+    rebuilds the data as of a version, the current one by default
+    starts from the compacted base and replays deltas after it, or undoes deltas back to an earlier version
+    '''
+    m = manifest(path)
+    version = m["version"] if version is None else version
+    if columns is not None and "Account ID" not in columns:
+        columns = ["Account ID"] + list(columns)
+    base = m["base"]["version"]
+    df = _read(path, m["base"]["file"], columns)
+    entries = {entry["version"] : entry for entry in m["versions"]}
+    for v in range(base + 1, version + 1):
+        entry = entries[v]
+        df = apply_delta(df, _read(path, entry["upserts"], columns), _ids(_read(path, entry["removals"])))
+    for v in range(base, version, -1):
+        entry = entries[v]
+        df = apply_delta(df, _read(path, entry["before"], columns), _ids(_read(path, entry["added"])))
+    return df
+
+def undo_delta(path: str, version: int) -> tuple:
+    '''
+    returns (upserts, removed ids) taking the current data back to an earlier version
+    read from the undo files of the later versions only, so it costs as much as the changes being undone
+    '''
+    m = manifest(path)
+    rows, befores = [], []
+    for entry in m["versions"]:
+        if entry["version"] > version:
+            before = _read(path, entry["before"])
+            added = _read(path, entry["added"])
+            befores.append(before)
+            rows.append(before.assign(_version=entry["version"], _removed=False))
+            rows.append(added.assign(_version=entry["version"], _removed=True))
+    rows = [r for r in rows if not r.empty]
+    if not rows:
+        return pd.DataFrame(), pd.Series([], dtype=object)
+
+    # the earliest undone change of each id holds its state at the target version,
+    # and within a change the last row of an id wins like it does in merges
+    undo = pd.concat(rows, ignore_index=True).sort_values("_version", kind="stable")
+    undo = undo.drop_duplicates(subset=["Account ID", "_version"], keep="last")
+    undo = undo.drop_duplicates(subset="Account ID", keep="first")
+    removed = undo["Account ID"][undo["_removed"]]
+    upserts = undo[~undo["_removed"]].drop(columns=["_version", "_removed"])
+
+    # the added ids have no other columns, give the restored rows back the types they were stored with
+    dtypes = pd.concat([before for before in befores if not before.empty]).dtypes if upserts.size else {}
+    upserts = upserts.astype({col : dtype for col, dtype in dtypes.items() if not isinstance(dtype, pd.CategoricalDtype)})
+    return upserts.reset_index(drop=True), removed.reset_index(drop=True)
+
+@timed
+def rollback(path: str, current: pd.DataFrame, version: int) -> tuple:
+    '''
+    returns the data as of an earlier version, recorded as a new version so the rollback can be undone too
+    also returns the rows it changed before and after, like merge_csv_chunks' on_change
+    '''
+    upserts, removed = undo_delta(path, version)
+    append(path, current, upserts, removed, note=f"rollback to version {version}")
+    touched = pd.DataFrame({"Account ID" : pd.concat([_ids(upserts), removed], ignore_index=True)})
+    df = apply_delta(current, upserts, removed)
+    return df, touched_rows(current, touched), touched_rows(df, touched)
+
+@timed
+def compact(path: str, df: pd.DataFrame, version: int) -> None:
+    '''
+    writes df, the data as of version, as the new base and deletes the deltas it replaces
+    undo files are kept so earlier versions can still be restored
+    '''
+    name = _write(path, _file("base", version), df)
+    with _lock:
+        m = manifest(path)
+        if m["base"]["version"] >= version:
+            return
+        old = m["base"]["file"]
+        m["base"] = {"version" : version, "file" : name}
+        replaced = []
+        for entry in m["versions"]:
+            if entry["version"] <= version:
+                replaced += [entry["upserts"], entry["removals"]]
+                entry["upserts"] = entry["removals"] = None
+        _write_manifest(path, m)
+    for name in [old] + replaced:
+        if name is not None:
+            os.remove(os.path.join(path, name))
+
+def maybe_compact(path: str, df: pd.DataFrame, version: int) -> None:
+    '''
+    compacts in a background thread once COMPACT_AFTER deltas have piled up on the base
+    '''
+    if version is None or version - manifest(path)["base"]["version"] < COMPACT_AFTER or path in _compacting:
+        return
+    _compacting.add(path)
+    def run():
+        try:
+            compact(path, df, version)
+        finally:
+            _compacting.discard(path)
+    threading.Thread(target=run, daemon=True).start()
@@ -0,0 +1,76 @@
+import contextlib
+import threading
+
+import pandas as pd
+
+from modules import cache
+from modules.dataset import load_data, load_rollup, load_dates, load_sketches, data_modified
+
+# one copy of the dataset and its indexes for the whole process, swapped for a new version on every merge
+_snapshot = None
+
+# held by writers, so merges and rollbacks from different sessions run one at a time
+_lock = threading.RLock()
+
+def _make(version: int, df: pd.DataFrame, rollup: pd.DataFrame, dates: pd.Series, sketches: dict) -> dict:
+    return {
+        "version" : version,
+        "modified" : data_modified(),
+        "df" : df,
+        "fingerprint" : cache.fingerprint(df),
+        "rollup" : rollup,
+        "dates" : dates,
+        "sketches" : sketches
+    }
+
+def snapshot() -> dict:
+    '''
+    returns the current shared dataset: version, df, fingerprint, rollup, dates and sketches
+    it is loaded from disk the first time, or again if another process saved a version since,
+    and every session gets the same objects, which must not be modified
+    '''
+    global _snapshot
+    if _snapshot is None or _snapshot["modified"] != data_modified():
+        with _lock:
+            if _snapshot is None or _snapshot["modified"] != data_modified():
+                df = load_data()
+                rollup = load_rollup(df) if not df.empty else None
+                dates = load_dates(df) if not df.empty else None
+                sketches = load_sketches(df) if not df.empty else None
+                _snapshot = _make(0 if _snapshot is None else _snapshot["version"] + 1, df, rollup, dates, sketches)
+    return _snapshot
+
+@contextlib.contextmanager
+def writer():
+    '''
+    holds the write lock and yields the latest snapshot, which a merge should start from
+    rather than the possibly older one a session holds
+    '''
+    with _lock:
+        yield snapshot()
+
+def publish(df: pd.DataFrame, rollup: pd.DataFrame, dates: pd.Series, sketches: dict) -> dict:
+    '''
+    swaps in a new version of the dataset, sessions pick it up on their next run through attach
+    '''
+    global _snapshot
+    with _lock:
+        version = _snapshot["version"] + 1 if _snapshot is not None else 0
+        _snapshot = _make(version, df, rollup, dates, sketches)
+        return _snapshot
+
+def attach(session) -> None:
+    '''
+    points a session's df, rollup, dates, sketches and fingerprint at the current snapshot if the session is behind
+    the session's df is a shallow copy: it shares the snapshot's data, and copy-on-write keeps
+    any change a session makes to it from reaching other sessions
+    '''
+    snap = snapshot()
+    if session.get("df_version") == snap["version"] and "df" in session:
+        return
+    session["df"] = snap["df"].copy(deep=False)
+    session["df_fingerprint"] = snap["fingerprint"]
+    session["rollup"] = snap["rollup"]
+    session["dates"] = snap["dates"]
+    session["sketches"] = snap["sketches"]
+    session["df_version"] = snap["version"]
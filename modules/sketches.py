@@ -0,0 +1,355 @@
+import math
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+from modules.data_analysis import (SEGMENTS, cents_to_dollars, donations_cents, donations_known, mean_cents,
+                                   merge_histograms)
+from modules.perf import timed
+
+# default relative errors of the sketches
+DISTINCT_ERROR = 0.01
+QUANTILE_ERROR = 0.005
+HEAVY_HITTERS = 1000
+
+# rows sketched at a time, bounds the memory of the temporary arrays whatever the size of the data
+BLOCK_SIZE = 250_000
+
+_POWERS = np.left_shift(np.uint64(1), np.arange(64, dtype=np.uint64))
+
+# odd multiplier of the text hash, and the splitmix64 constants that mix its bits
+_TEXT_MULTIPLIER = np.uint64(0x100000001B3)
+_MIX = (np.uint64(0xBF58476D1CE4E5B9), np.uint64(0x94D049BB133111EB))
+
+# distinct counts: HyperLogLog
+
+def hll_precision(error: float) -> int:
+    '''
+    number of index bits giving the requested relative standard error
+    '''
+    return min(max(math.ceil(math.log2((1.04 / error) ** 2)), 4), 18)
+
+def _mix(h: np.ndarray) -> np.ndarray:
+    h = (h ^ (h >> np.uint64(30))) * _MIX[0]
+    h = (h ^ (h >> np.uint64(27))) * _MIX[1]
+    return h ^ (h >> np.uint64(31))
+
+def _hash_text(values: pd.Series) -> np.ndarray:
+    '''
+    64 bit hashes of non-null text values, computed from their utf-8 bytes in the arrow buffers
+    a polynomial over each value's bytes is taken from one running sum over all bytes, then mixed
+    '''
+    res = []
+    for chunk in pyarrow.chunked_array(pyarrow.array(values, type=pyarrow.large_string())).chunks:
+        offsets = np.frombuffer(chunk.buffers()[1], dtype="int64")[chunk.offset:chunk.offset + len(chunk) + 1]
+        data = np.frombuffer(chunk.buffers()[2], dtype="uint8")[offsets[0]:offsets[-1]] if offsets[-1] > offsets[0] else np.zeros(0, "uint8")
+        starts, lengths = offsets[:-1] - offsets[0], np.diff(offsets)
+
+        # byte j of a value is weighted by multiplier ** j, sums wrap around at 64 bits
+        position = np.arange(len(data)) - np.repeat(starts, lengths)
+        weights = np.cumprod(np.r_[np.uint64(1), np.full(max(int(lengths.max(initial=0)) - 1, 0), _TEXT_MULTIPLIER)])
+        running = np.r_[np.uint64(0), np.cumsum(data.astype("uint64") * weights[position], dtype="uint64")]
+        h = running[starts + lengths] - running[starts]
+        res.append(_mix(h ^ _mix(lengths.astype("uint64"))))
+    return np.concatenate(res) if res else np.zeros(0, dtype="uint64")
+
+def hash_values(values) -> np.ndarray:
+    '''
+    64 bit hashes of the non-null values without building python strings
+    whole numbers are hashed as integers and text by its bytes, so an id hashes the same in the data and in uploads
+    '''
+    values = pd.Series(values).dropna()
+    if pd.api.types.is_integer_dtype(values) or (pd.api.types.is_float_dtype(values) and (values % 1 == 0).all()):
+        return pd.util.hash_array(values.to_numpy(dtype="int64"))
+    if pyarrow is not None:
+        return _hash_text(values.astype("string"))
+    return pd.util.hash_array(values.astype("string").to_numpy(dtype=object))
+
+def hll_registers(hashes: np.ndarray, error: float = DISTINCT_ERROR) -> np.ndarray:
+    '''
+    returns the HyperLogLog registers of hashed values
+    '''
+    p = hll_precision(error)
+    registers = np.zeros(2 ** p, dtype="uint8")
+    if len(hashes) == 0:
+        return registers
+    index = (hashes >> np.uint64(64 - p)).astype("int64")
+    rest = hashes & np.uint64(2 ** (64 - p) - 1)
+
+    # rank is the position of the first set bit of the remaining hash bits
+    bit_length = np.searchsorted(_POWERS, rest, side="right")
+    rank = (64 - p - bit_length + 1).astype("uint8")
+    np.maximum.at(registers, index, rank)
+    return registers
+
+def hll(values, error: float = DISTINCT_ERROR) -> np.ndarray:
+    '''
+    returns the HyperLogLog registers of the distinct non-null values
+    '''
+    return hll_registers(hash_values(values), error)
+
+def hll_merge(registers: list) -> np.ndarray:
+    return np.maximum.reduce(registers)
+
+def hll_count(registers: np.ndarray) -> int:
+    '''
+    estimated number of distinct values
+    '''
+    m = len(registers)
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / np.sum(np.power(2.0, -registers.astype("float64")))
+    zeros = int((registers == 0).sum())
+    if estimate <= 2.5 * m and zeros:
+        estimate = m * math.log(m / zeros)
+    return int(round(estimate))
+
+# quantiles: log-bucketed histogram with relative accuracy
+
+def bucket_keys(cents: np.ndarray, error: float = QUANTILE_ERROR) -> np.ndarray:
+    '''
+    quantile bucket of each cents value, every value in a bucket is within error of the bucket's value
+    key -1 holds zeros and negative amounts
+    '''
+    gamma = (1 + error) / (1 - error)
+    cents = np.asarray(cents, dtype="float64")
+    return np.where(cents > 0, np.ceil(np.log(np.maximum(cents, 1)) / math.log(gamma)), -1).astype("int64")
+
+def _nonzero_buckets(counts: np.ndarray) -> tuple:
+    # (bucket keys, counts) of the non-empty buckets of a bincount over keys + 1
+    nonzero = np.flatnonzero(counts)
+    return nonzero - 1, counts[nonzero].astype("int64")
+
+def quantile_sketch(cents: np.ndarray, error: float = QUANTILE_ERROR) -> tuple:
+    '''
+    returns (bucket keys, counts) of the cents values, counted with one bincount instead of a sort
+    see bucket_keys
+    '''
+    return _nonzero_buckets(np.bincount(bucket_keys(cents, error) + 1))
+
+def quantile(sketch: tuple, q: float, error: float = QUANTILE_ERROR) -> int:
+    '''
+    estimated q-quantile in cents
+    '''
+    keys, counts = sketch
+    gamma = (1 + error) / (1 - error)
+    rank = q * (counts.sum() - 1)
+    key = keys[np.searchsorted(np.cumsum(counts), rank, side="right")]
+    if key < 0:
+        return 0
+    return int(round(2 * gamma ** key / (gamma + 1)))
+
+# mode: Misra-Gries heavy hitters
+
+def heavy_hitters(values: np.ndarray, counts: np.ndarray, k: int = HEAVY_HITTERS) -> tuple:
+    '''
+    reduces a (values, counts) histogram to at most k counters
+    each kept count is at most total / (k + 1) below the true count
+    '''
+    if len(values) <= k:
+        return values, counts
+    cutoff = np.partition(counts, len(counts) - k - 1)[len(counts) - k - 1]
+    counts = counts - cutoff
+    keep = counts > 0
+    return values[keep], counts[keep]
+
+def value_counts(values: np.ndarray, k: int = HEAVY_HITTERS) -> tuple:
+    '''
+    Misra-Gries counters of a block of values, counted with a hash table and reduced to at most k
+    '''
+    counts = pd.Series(values).value_counts(sort=False)
+    return heavy_hitters(counts.index.to_numpy(dtype="int64"), counts.to_numpy(dtype="int64"), k)
+
+def merge_counters(counters: list, k: int = HEAVY_HITTERS) -> tuple:
+    '''
+    merges Misra-Gries counters of different rows into at most k counters, dropping any that are no longer positive
+    merged counters keep the error bound of counters built over all the rows at once
+    '''
+    values, counts = merge_histograms(counters)
+    keep = counts > 0
+    return heavy_hitters(values[keep], counts[keep], k)
+
+def _negated(histogram: tuple) -> tuple:
+    return histogram[0], -np.asarray(histogram[1], dtype="int64")
+
+# segment stats
+
+def _block_sketch(df: pd.DataFrame, error: float, quantile_error: float, k: int) -> dict:
+    '''
+    sketches of one block of rows, see sketch_partials
+    '''
+    gifts = df["Number of Gifts Past 18 Months"].to_numpy(dtype="float64", na_value=np.nan)
+    cents = donations_cents(df)
+    key = np.where(gifts > 0, 0, np.where((gifts == 0) | np.isnan(gifts), 1, 2))
+
+    # null ids are not donors
+    ids = df["Account ID"]
+    hashes = hash_values(ids)
+    id_key = key[ids.notna().to_numpy()]
+
+    # rows without an amount are donors but have no amount to average or rank
+    known = donations_known(df)
+    known_cents = cents[known]
+    known_key = key[known]
+
+    # the buckets of every segment in one bincount, one row of buckets per segment
+    buckets = bucket_keys(known_cents, quantile_error) + 1
+    width = int(buckets.max(initial=0)) + 1
+    by_segment = np.bincount(known_key * width + buckets, minlength=3 * width).reshape(3, width)
+
+    return {
+        "error" : error,
+        "quantile error" : quantile_error,
+        "distinct" : np.stack([hll_registers(hashes[id_key == k_], error) for k_ in range(3)]),
+        "id rows" : np.bincount(id_key, minlength=3),
+        "quantiles" : [_nonzero_buckets(row) for row in by_segment],
+        "heavy hitters" : [value_counts(known_cents[known_key == k_], k) for k_ in range(3)],
+        "totals" : np.array([int(cents[key == k_].sum()) for k_ in range(3)]),
+        "rows" : np.bincount(known_key, minlength=3),
+        "gifts" : np.bincount(key, weights=np.nan_to_num(gifts), minlength=3),
+        "gift rows" : np.bincount(key, weights=~np.isnan(gifts), minlength=3)
+    }
+
+@timed
+def sketch_partials(df: pd.DataFrame, error: float = DISTINCT_ERROR, quantile_error: float = QUANTILE_ERROR,
+                    k: int = HEAVY_HITTERS) -> dict:
+    '''
+    builds mergeable sketches of the all, active and inactive donor segments
+    keys of the partition are 0 = active, 1 = inactive, 2 = neither, like segment_partials
+    totals and row counts are exact, distinct donors, medians and modes are approximate
+    rows are read BLOCK_SIZE at a time and each block's sketches are merged into the running ones,
+    so memory stays bounded by the block and the sketch sizes
+    '''
+    sketch = _block_sketch(df.iloc[:BLOCK_SIZE], error, quantile_error, k)
+    for start in range(BLOCK_SIZE, len(df), BLOCK_SIZE):
+        sketch = merge_sketches([sketch, _block_sketch(df.iloc[start:start + BLOCK_SIZE], error, quantile_error, k)], k)
+    return sketch
+
+def merge_sketches(sketches: list, k: int = HEAVY_HITTERS) -> dict:
+    '''
+    combines sketches of different row sets, e.g. blocks of the data
+    rows that update existing donors would be counted twice, use update_sketches for changes to the data
+    '''
+    return {
+        "error" : sketches[0]["error"],
+        "quantile error" : sketches[0]["quantile error"],
+        "distinct" : np.maximum.reduce([s["distinct"] for s in sketches]),
+        "id rows" : sum(s["id rows"] for s in sketches),
+        "quantiles" : [merge_histograms([s["quantiles"][i] for s in sketches]) for i in range(3)],
+        "heavy hitters" : [merge_counters([s["heavy hitters"][i] for s in sketches], k) for i in range(3)],
+        "totals" : sum(s["totals"] for s in sketches),
+        "rows" : sum(s["rows"] for s in sketches),
+        "gifts" : sum(s["gifts"] for s in sketches),
+        "gift rows" : sum(s["gift rows"] for s in sketches)
+    }
+
+@timed
+def update_sketches(sketch: dict, before: pd.DataFrame, after: pd.DataFrame, k: int = HEAVY_HITTERS) -> dict:
+    '''
+    updates segment sketches for changed rows without rescanning the data, like update_rollup
+    before holds the changed rows as they were, after holds them as they are now including new rows
+    totals, row counts and median buckets take the change exactly and the counters of replaced amounts are lowered
+    distinct counts cannot forget a donor, so one who moved segment stays in the old one's registers,
+    sketch_table caps them by the exact count of rows with an id, which merges keep unique
+    '''
+    old = sketch_partials(before, sketch["error"], sketch["quantile error"], k)
+    new = sketch_partials(after, sketch["error"], sketch["quantile error"], k)
+    quantiles = []
+    for i in range(3):
+        keys, counts = merge_histograms([sketch["quantiles"][i], new["quantiles"][i], _negated(old["quantiles"][i])])
+        quantiles.append((keys[counts > 0], counts[counts > 0]))
+    return {
+        "error" : sketch["error"],
+        "quantile error" : sketch["quantile error"],
+        "distinct" : np.maximum(sketch["distinct"], new["distinct"]),
+        "id rows" : sketch["id rows"] + new["id rows"] - old["id rows"],
+        "quantiles" : quantiles,
+        "heavy hitters" : [merge_counters([sketch["heavy hitters"][i], new["heavy hitters"][i], _negated(old["heavy hitters"][i])], k)
+                           for i in range(3)],
+        "totals" : sketch["totals"] + new["totals"] - old["totals"],
+        "rows" : sketch["rows"] + new["rows"] - old["rows"],
+        "gifts" : sketch["gifts"] + new["gifts"] - old["gifts"],
+        "gift rows" : sketch["gift rows"] + new["gift rows"] - old["gift rows"]
+    }
+
+def sketch_table(sketch: dict) -> pd.DataFrame:
+    '''
+    turns segment sketches into a segment_stats dataframe with an Approximate column
+    both the distinct count estimate and the rows with an id only ever count too many donors, the smaller is reported
+    '''
+    rows = []
+    for segment in SEGMENTS:
+        if segment == "All":
+            parts = [0, 1, 2]
+            distinct = hll_merge(list(sketch["distinct"]))
+        else:
+            parts = [SEGMENTS.index(segment) - 1]
+            distinct = sketch["distinct"][parts[0]]
+        n = int(sum(sketch["rows"][i] for i in parts))
+        id_rows = int(sum(sketch["id rows"][i] for i in parts))
+        total = int(sum(sketch["totals"][i] for i in parts))
+        n_gifts = sum(sketch["gifts"][i] for i in parts)
+        n_gift_rows = sum(sketch["gift rows"][i] for i in parts)
+        quantiles = merge_histograms([sketch["quantiles"][i] for i in parts])
+        values, counts = merge_histograms([sketch["heavy hitters"][i] for i in parts])
+        empty = n == 0
+        rows.append({
+            "Donors" : min(hll_count(distinct), id_rows),
+            "Total Donation Amount" : cents_to_dollars(total),
+            "Average Total Donation" : float("nan") if empty else cents_to_dollars(mean_cents(total, n)),
+            "Median Total Donation" : float("nan") if empty else cents_to_dollars(quantile(quantiles, 0.5, sketch["quantile error"])),
+            "Modal Total Donation" : float("nan") if empty else cents_to_dollars(int(values[np.argmax(counts)])),
+            "Gifts in Past 18 Months" : int(n_gifts),
+            "Average Gifts Past 18 Months" : round(n_gifts / n_gift_rows, 2) if n_gift_rows else float("nan"),
+            "Approximate" : True
+        })
+    return pd.DataFrame(rows, index=pd.Index(SEGMENTS, name="Segment"))
+
+@timed
+def approx_segment_stats(df: pd.DataFrame, error: float = DISTINCT_ERROR, quantile_error: float = QUANTILE_ERROR,
+                         k: int = HEAVY_HITTERS) -> pd.DataFrame:
+    '''
+    segment_stats with approximate distinct donors, median and mode, usable by basic_stats and friends
+    '''
+    return sketch_table(sketch_partials(df, error, quantile_error, k))
+
+def save_sketches(sketch: dict, path: str) -> None:
+    '''
+    stores segment sketches in a numpy .npz file
+    '''
+    arrays = {
+        "error" : np.array(sketch["error"]),
+        "quantile_error" : np.array(sketch["quantile error"]),
+        "distinct" : sketch["distinct"],
+        "id_rows" : sketch["id rows"],
+        "totals" : sketch["totals"],
+        "rows" : sketch["rows"],
+        "gifts" : sketch["gifts"],
+        "gift_rows" : sketch["gift rows"],
+    }
+    for i in range(3):
+        arrays[f"quantile_keys_{i}"], arrays[f"quantile_counts_{i}"] = sketch["quantiles"][i]
+        arrays[f"heavy_values_{i}"], arrays[f"heavy_counts_{i}"] = sketch["heavy hitters"][i]
+    with open(path, "wb") as f:
+        np.savez(f, **arrays)
+
+def load_sketches(path: str) -> dict:
+    '''
+    loads segment sketches stored with save_sketches
+    '''
+    with np.load(path) as f:
+        return {
+            "error" : float(f["error"]),
+            "quantile error" : float(f["quantile_error"]),
+            "distinct" : f["distinct"],
+            "id rows" : f["id_rows"],
+            "quantiles" : [(f[f"quantile_keys_{i}"], f[f"quantile_counts_{i}"]) for i in range(3)],
+            "heavy hitters" : [(f[f"heavy_values_{i}"], f[f"heavy_counts_{i}"]) for i in range(3)],
+            "totals" : f["totals"],
+            "rows" : f["rows"],
+            "gifts" : f["gifts"],
+            "gift rows" : f["gift_rows"]
+        }
@@ -0,0 +1,118 @@
+import os
+import threading
+import pandas as pd
+
+try:
+    import pyarrow
+    import pyarrow.feather
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# location columns are stored dictionary encoded
+CATEGORICAL = ["City", "State", "Country"]
+
+def apply_schema(df: pd.DataFrame) -> pd.DataFrame:
+    '''
+    returns a copy of the dataframe with types a columnar file can hold
+    location columns become categorical and other text or mixed columns become strings
+    numeric and datetime columns are kept as they are
+    '''
+    df = df.copy()
+    for col in df.columns:
+        dtype = df[col].dtype
+        if col in CATEGORICAL:
+            if not isinstance(dtype, pd.CategoricalDtype):
+                df[col] = df[col].astype("string").astype("category")
+        elif not (pd.api.types.is_numeric_dtype(dtype) or pd.api.types.is_datetime64_any_dtype(dtype)
+                  or isinstance(dtype, pd.CategoricalDtype)):
+            df[col] = df[col].astype("string")
+    return df
+
+def _read_parquet(path: str, columns: list = None) -> pd.DataFrame:
+    return pd.read_parquet(path, columns=columns)
+
+def _write_parquet(df: pd.DataFrame, path: str) -> None:
+    apply_schema(df).to_parquet(path, index=False)
+
+def _read_feather(path: str, columns: list = None) -> pd.DataFrame:
+    return pd.read_feather(path, columns=columns)
+
+def _write_feather(df: pd.DataFrame, path: str) -> None:
+    apply_schema(df).reset_index(drop=True).to_feather(path)
+
+def _read_csv(path: str, columns: list = None) -> pd.DataFrame:
+    return pd.read_csv(path, usecols=columns)
+
+def _write_csv(df: pd.DataFrame, path: str) -> None:
+    df.to_csv(path, index=False)
+
+# file extension -> (reader, writer)
+BACKENDS = {
+    ".parquet": (_read_parquet, _write_parquet),
+    ".feather": (_read_feather, _write_feather),
+    ".csv": (_read_csv, _write_csv),
+}
+
+# parquet and feather need pyarrow, csv is the fallback without it
+DEFAULT_FORMAT = ".parquet" if pyarrow is not None else ".csv"
+
+def dataset_path(name: str, fmt: str = None) -> str:
+    '''
+    returns the file path for a stored dataset name in the given or default format
+    '''
+    return name + (fmt or DEFAULT_FORMAT)
+
+def backend(path: str) -> tuple:
+    '''
+    returns the (reader, writer) pair for a file path based on its extension
+    '''
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in BACKENDS:
+        raise ValueError(f"Unsupported storage format: {ext}")
+    return BACKENDS[ext]
+
+def stored_columns(path: str) -> list:
+    '''
+    returns the column names of a stored dataset without reading its rows
+    '''
+    if path.lower().endswith(".csv"):
+        return list(pd.read_csv(path, nrows=0).columns)
+    return list(pyarrow.parquet.read_schema(path).names if path.lower().endswith(".parquet")
+                else pyarrow.feather.read_table(path, memory_map=True).schema.names)
+
+def read(path: str, columns: list = None) -> pd.DataFrame:
+    '''
+    reads a stored dataset, only the given columns that it has are read if columns is set
+    '''
+    reader, _ = backend(path)
+    if columns is not None:
+        available = set(stored_columns(path))
+        columns = [col for col in columns if col in available]
+    return reader(path, columns)
+
+def write(df: pd.DataFrame, path: str) -> None:
+    '''
+    writes a dataset in the format given by the path's extension
+    the file is written next to the path and renamed over it, so readers never see a partial file
+    '''
+    _, writer = backend(path)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        writer(df, tmp)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def migrate(src: str, dest: str, convert=None) -> pd.DataFrame:
+    '''
+    one-time conversion of a stored dataset to another format
+    convert is applied to the loaded data before it is written, e.g. to clean it
+    returns the converted dataframe
+    '''
+    df = read(src)
+    if convert is not None:
+        df = convert(df)
+    write(df, dest)
+    return df
@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+
+# dataset sizes used by the benchmarks
+SIZES = {
+    "10k": 10_000,
+    "100k": 100_000,
+    "1m": 1_000_000,
+    "10m": 10_000_000,
+}
+
+# (city, state) pairs, most donors come from the first few
+CITIES = [
+    ("Ossining", "NY"), ("Beacon", "NY"), ("Peekskill", "NY"), ("New York", "NY"), ("Cold Spring", "NY"),
+    ("Tarrytown", "NY"), ("Poughkeepsie", "NY"), ("Kingston", "NY"), ("Albany", "NY"), ("Yonkers", "NY"),
+    ("Brooklyn", "NY"), ("Croton-On-Hudson", "NY"), ("Nyack", "NY"), ("Newburgh", "NY"), ("Hudson", "NY"),
+    ("Hoboken", "NJ"), ("Jersey City", "NJ"), ("Montclair", "NJ"), ("Greenwich", "CT"), ("Stamford", "CT"),
+    ("Boston", "MA"), ("Philadelphia", "PA"), ("Burlington", "VT"), ("Los Angeles", "CA"), ("Chicago", "IL"),
+    ("Toronto", "ON"), ("Montreal", "QC"),
+]
+
+# amounts many donors give exactly
+ROUND_AMOUNTS = np.array([10, 20, 25, 35, 50, 100, 250, 500, 1000])
+
+def _zipf_choice(rng: np.random.Generator, k: int, n: int, a: float = 1.2) -> np.ndarray:
+    '''
+    returns n indexes in [0, k) where low indexes are much more common
+    '''
+    weights = 1 / np.arange(1, k + 1) ** a
+    return rng.choice(k, size=n, p=weights / weights.sum())
+
+def _format_dollars(amounts: np.ndarray) -> pd.Series:
+    '''
+    formats amounts like the CRM export, e.g. "$1,234.56"
+    '''
+    return pd.Series(amounts).map("${:,.2f}".format)
+
+def generate(n: int, seed: int = 0, start_id: int = 0) -> pd.DataFrame:
+    '''
+    returns a synthetic donor export with n rows in the same schema and string formats as the CRM export
+    locations, amounts and activity are skewed like real donor files:
+        a few cities hold most donors, some rows have odd casing or no location,
+        totals are log-normal with spikes at round amounts,
+        most donors have not given in the past 18 months
+    '''
+    rng = np.random.default_rng(seed)
+
+    # locations, with some lower case cities, country only and empty rows
+    cities = np.array([city for city, _ in CITIES], dtype=object)
+    states = np.array([state for _, state in CITIES], dtype=object)
+    place = _zipf_choice(rng, len(CITIES), n)
+    city = cities[place]
+    state = states[place]
+    country = np.where(np.isin(state, ["ON", "QC"]), "Canada", "United States").astype(object)
+    lower = rng.random(n) < 0.05
+    city[lower] = [c.lower() for c in city[lower]]
+    country_only = rng.random(n) < 0.02
+    city[country_only] = np.nan
+    state[country_only] = np.nan
+    no_location = rng.random(n) < 0.01
+    city[no_location] = np.nan
+    state[no_location] = np.nan
+    country[no_location] = np.nan
+
+    # totals in cents
+    cents = np.rint(rng.lognormal(mean=4.0, sigma=1.4, size=n) * 100)
+    round_amount = rng.random(n) < 0.3
+    cents[round_amount] = ROUND_AMOUNTS[_zipf_choice(rng, len(ROUND_AMOUNTS), int(round_amount.sum()), 0.8)] * 100
+    cents = np.maximum(cents, 100)
+
+    # last gift dates skewed towards recent years and gift counts in the past 18 months
+    end = pd.Timestamp("2025-12-31")
+    days_ago = np.minimum(rng.exponential(scale=900, size=n).astype("int64"), 365 * 25)
+    last_gift = end - pd.to_timedelta(days_ago, unit="D")
+    recent = days_ago < 548
+    gifts = np.where(recent, rng.geometric(0.45, size=n), 0)
+
+    return pd.DataFrame({
+        "Account ID" : pd.Series(np.arange(start_id, start_id + n)).map("{:07d}".format),
+        "City" : city,
+        "State" : state,
+        "BFPO No" : np.nan,
+        "Postcode" : pd.Series(rng.integers(501, 99950, size=n)).map("{:05d}".format),
+        "Country" : country,
+        "Total Gifts (All Time)" : _format_dollars(cents / 100),
+        "Last Gift Date" : last_gift.strftime("%m/%d/%Y"),
+        "Number of Gifts Past 18 Months" : gifts,
+    })
+
+def upload(df: pd.DataFrame, n: int, overlap: float, seed: int = 1) -> pd.DataFrame:
+    '''
+    returns a synthetic upload of n rows where the overlap fraction are updated rows of df
+    and the rest are new donors
+    '''
+    rng = np.random.default_rng(seed)
+    shared = min(int(n * overlap), len(df))
+    new = generate(n - shared, seed=seed, start_id=len(df) + 10_000_000)
+    updated = generate(shared, seed=seed + 1)
+    updated["Account ID"] = df["Account ID"].to_numpy()[rng.choice(len(df), size=shared, replace=False)]
+    return pd.concat([updated, new], ignore_index=True)
@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+
+from modules.perf import timed
+
+# a scheme is (breakpoints, labels): values below the first breakpoint get the first label,
+# values from one breakpoint up to the next get the label after it
+SCHEMES = {
+    # from riverkeeper's website, see categorize_donors
+    "Riverkeeper" : ([20, 50, 250], ["under 20", "20+", "50+", "250+"]),
+    "Giving Levels" : ([100, 1000, 10000], ["under 100", "100+", "mid-level 1,000+", "major 10,000+"]),
+}
+
+# days since the last gift
+RECENCY = ([548, 1096], ["0-18 months", "18-36 months", "36+ months"])
+
+def _check(breakpoints, labels) -> np.ndarray:
+    breakpoints = np.asarray(breakpoints, dtype="float64")
+    if len(labels) != len(breakpoints) + 1:
+        raise ValueError(f"{len(breakpoints)} breakpoints need {len(breakpoints) + 1} labels, got {len(labels)}")
+    if np.any(np.diff(breakpoints) <= 0):
+        raise ValueError("Breakpoints must be strictly increasing")
+    return breakpoints
+
+def _values(values) -> np.ndarray:
+    return pd.Series(values).to_numpy(dtype="float64", na_value=np.nan)
+
+def _categorical(codes: np.ndarray, labels: list, index=None, name=None) -> pd.Series:
+    return pd.Series(pd.Categorical.from_codes(codes, categories=labels, ordered=True), index=index, name=name)
+
+@timed
+def tier(values, breakpoints, labels, name: str = None) -> pd.Series:
+    '''
+    returns an ordered categorical of the tier of each value, found with one binary search per value
+    missing values have no tier
+    '''
+    breakpoints = _check(breakpoints, labels)
+    x = _values(values)
+    codes = np.searchsorted(breakpoints, x, side="right")
+    codes[np.isnan(x)] = -1
+    return _categorical(codes, labels, getattr(values, "index", None), name)
+
+@timed
+def tier_many(values, schemes: dict = SCHEMES) -> pd.DataFrame:
+    '''
+    returns a dataframe with the tiers of the values under every scheme, one column per scheme name
+    values are binary searched once over the merged breakpoints of all schemes,
+    each scheme then maps the merged intervals to its own tiers with a small lookup table
+    '''
+    checked = {name : _check(*scheme) for name, scheme in schemes.items()}
+    merged = np.unique(np.concatenate([np.zeros(0)] + list(checked.values())))
+    x = _values(values)
+    interval = np.searchsorted(merged, x, side="right")
+    missing = np.isnan(x)
+
+    res = {}
+    for name, breakpoints in checked.items():
+        # interval k holds values from merged[k - 1] up to merged[k]
+        lookup = np.r_[0, np.searchsorted(breakpoints, merged, side="right")]
+        codes = lookup[interval]
+        codes[missing] = -1
+        res[name] = pd.Categorical.from_codes(codes, categories=schemes[name][1], ordered=True)
+    return pd.DataFrame(res, index=getattr(values, "index", None))
+
+@timed
+def rfm_segments(df: pd.DataFrame, as_of=None, recency: tuple = RECENCY, amount: tuple = SCHEMES["Riverkeeper"]) -> pd.Series:
+    '''
+    returns recency x amount segments, e.g. "0-18 months / 250+", as an ordered categorical
+    recency is the number of days from the last gift to as_of, today by default
+    '''
+    as_of = pd.Timestamp(as_of if as_of is not None else pd.Timestamp.today()).normalize()
+    days = (as_of - pd.to_datetime(df["Last Gift Date"])).dt.days
+    r = tier(days, *recency).cat.codes.to_numpy()
+    a = tier(df["Total Gifts (All Time)"], *amount).cat.codes.to_numpy()
+    codes = np.where((r >= 0) & (a >= 0), r * len(amount[1]) + a, -1)
+    labels = [f"{r_label} / {a_label}" for r_label in recency[1] for a_label in amount[1]]
+    return _categorical(codes, labels, df.index, "Segment")
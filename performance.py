@@ -0,0 +1,34 @@
+import streamlit as st
+from modules import perf
+
+def run():
+
+    st.set_page_config(
+    page_title="Performance",
+    page_icon="⏱️",
+    layout="wide"
+    )
+
+    st.header("Performance")
+    st.write("Wall time, peak memory above the starting point and input rows for each instrumented function and page section. \
+             Memory is traced for the whole process, so peaks are left empty for sections that ran while another session's were running. \
+             Set RIVERKEEPER_PERF=1 to record from startup.")
+
+    on = st.toggle("Record timings", value=perf.enabled())
+    if on != perf.enabled():
+        perf.enable(on)
+
+    st.space(size="small")
+    st.markdown("<h4 style='text-align: center;'>Summary</h4>", unsafe_allow_html=True)
+    st.dataframe(perf.summary())
+
+    st.markdown("<h4 style='text-align: center;'>Recent Calls</h4>", unsafe_allow_html=True)
+    st.dataframe(perf.records().iloc[::-1])
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button("Download JSON", perf.export_json(), file_name="performance.json", mime="application/json")
+    with col2:
+        if st.button("Clear"):
+            perf.clear()
+            st.rerun()
@@ -0,0 +1,52 @@
+import argparse
+import os
+import time
+
+import pandas as pd
+
+from modules.data_analysis import clean
+from modules.dataset import load_data, load_rollup, load_dates
+from modules.reports import COLUMNS, report_tables
+
+FORMATS = ["csv", "json", "parquet"]
+
+def write_table(df, path: str, fmt: str) -> None:
+    '''
+    writes one report table, keeping its index as columns
+    '''
+    df = df.reset_index() if any(df.index.names) else df
+    # periods are written as their labels, e.g. 2024-05
+    df = df.astype({col: str for col in df.columns if isinstance(df[col].dtype, pd.PeriodDtype)})
+    if fmt == "csv":
+        df.to_csv(path, index=False)
+    elif fmt == "json":
+        df.to_json(path, orient="records", date_format="iso", indent=2)
+    else:
+        df.astype({col: str for col in df.columns if df[col].dtype == object}).to_parquet(path, index=False)
+
+def run(out: str, fmt: str, n: int) -> None:
+    '''
+    loads the stored dataset and writes every analytics table to the out directory
+    '''
+    start = time.perf_counter()
+    data = load_data(columns=COLUMNS)
+    if data.empty:
+        raise SystemExit("No stored dataset to report on.")
+    rollup = load_rollup(data)
+    dates = load_dates(data)
+    clean(data)
+
+    os.makedirs(out, exist_ok=True)
+    for name, table in report_tables(data, rollup, n, dates).items():
+        path = os.path.join(out, f"{name}.{fmt}")
+        write_table(table, path, fmt)
+        print(f"Wrote {path}")
+    print(f"Report of {len(data):,} donors finished in {time.perf_counter() - start:.2f}s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write the donor analytics tables without starting the app.")
+    parser.add_argument("--out", default="reports", help="directory to write the tables to")
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--top", type=int, default=50, help="number of top and frequent donors")
+    args = parser.parse_args()
+    run(args.out, args.format, args.top)
@@ -1,9 +1,11 @@
 import streamlit as st
 from dataset_merger import run as run_dataset_merger
 from analytics import run as run_analytics
+from performance import run as run_performance
 
 dataset_merger = st.Page(run_dataset_merger, title="Dataset Merger", icon="📁", url_path="dataset_merger.py", default=True)
 analytics = st.Page(run_analytics, title="Donor Analytics", icon="📊", url_path="analytics.py")
+performance = st.Page(run_performance, title="Performance", icon="⏱️", url_path="performance.py", visibility="hidden")
 
-current_page = st.navigation([dataset_merger, analytics], position="top")
+current_page = st.navigation([dataset_merger, analytics, performance], position="top")
 current_page.run()
\ No newline at end of file
@@ -0,0 +1,34 @@
+import streamlit as st
+import pandas as pd
+from modules.cache import memo
+from modules.pagination import PAGE_SIZE, page, page_count, view_positions
+
+def paged_dataframe(df: pd.DataFrame, key: str, cache_key: str = None, size: int = PAGE_SIZE) -> None:
+    '''
+    shows df one page at a time, filtering, sorting and slicing on the server so only the visible page is sent to the browser
+    cache_key is the fingerprint of the data df derives from, so the row order of each filter and sort is computed once
+    key names the table and its widgets and must be unique on the page
+    '''
+    names = [name for name in df.index.names if name is not None] + list(df.columns)
+    search, order, direction, number = st.columns([3, 2, 1, 1], vertical_alignment="bottom")
+    query = search.text_input("Filter", key=f"{key}_filter", placeholder="Search all columns")
+    sort = order.selectbox("Sort by", [None] + names, key=f"{key}_sort", format_func=lambda name: "Original order" if name is None else name)
+    ascending = direction.toggle("Ascending", value=True, key=f"{key}_ascending")
+
+    if cache_key is None:
+        positions = view_positions(df, query, sort, ascending)
+    else:
+        positions = memo(f"{cache_key}/{key}", view_positions, df, query, sort, ascending)
+
+    # go back to the first page when a filter leaves fewer pages than the one shown
+    pages = page_count(len(positions), size)
+    if st.session_state.get(f"{key}_page", 1) > pages:
+        st.session_state[f"{key}_page"] = 1
+    current = number.number_input(f"Page of {pages:,}", min_value=1, max_value=pages, key=f"{key}_page")
+
+    st.dataframe(page(df, positions, current, size))
+    start = (current - 1) * size
+    if len(positions):
+        st.caption(f"Rows {start + 1:,}-{min(start + size, len(positions)):,} of {len(positions):,}")
+    else:
+        st.caption("No rows match the filter")
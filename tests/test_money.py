@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from modules.data_analysis import (avg_total_donation, donations_precise, median_total_donation, modal_total_donation,
+                                   segment_stats, to_cents, total_donations)
+
+# the Decimal stats as they were before the cents path, formatted the way the tables show them
+def precise_stats(df: pd.DataFrame) -> dict:
+    precise = donations_precise(df)
+    mode = precise.mode()
+    return {
+        "total" : f"{round(precise.sum(), 2):,.2f}",
+        "average" : f"{round(precise.mean(), 2):,.2f}",
+        "median" : f"{round(precise.median(), 2):,.2f}",
+        "mode" : f"{round(mode.iloc[0], 2):,.2f}",
+    }
+
+def cents_stats(df: pd.DataFrame) -> dict:
+    return {
+        "total" : f"{total_donations(df):,.2f}",
+        "average" : f"{avg_total_donation(df):,.2f}",
+        "median" : f"{median_total_donation(df):,.2f}",
+        "mode" : f"{modal_total_donation(df):,.2f}",
+    }
+
+def donations(amounts: list) -> pd.DataFrame:
+    df = pd.DataFrame({"Total Gifts (All Time)" : amounts})
+    df["Total Gifts Cents"] = to_cents(df["Total Gifts (All Time)"])
+    return df
+
+@pytest.mark.parametrize("amounts", [
+    [3.40, 4.31],
+    [8.94, 7.07],
+    [0.01],
+    [0.0, 0.0, 0.01],
+    [19.99, 20.0, 50.0, 250.0, 1234567.89],
+    [10.0, 30.0, 50.0, None],
+])
+def test_matches_decimal_path(amounts):
+    df = donations(amounts)
+    assert cents_stats(df) == precise_stats(df)
+
+def test_matches_decimal_path_random():
+    rng = np.random.default_rng(0)
+    for trial in range(500):
+        n = int(rng.integers(1, 40))
+        high = 1_000 if trial % 2 else 10_000_000
+        df = donations(list(rng.integers(0, high, n) / 100))
+        assert cents_stats(df) == precise_stats(df), df["Total Gifts (All Time)"].tolist()
+
+def test_parses_formatted_amounts():
+    amounts = pd.Series(["$1,234.56", "$0.10", None, "7"])
+    assert to_cents(amounts).tolist() == [123456, 10, 0, 700]
+
+def test_segment_stats_match_decimal_path():
+    rng = np.random.default_rng(1)
+    amounts = list(rng.integers(0, 100_000, 1001) / 100)
+    amounts[::50] = [None] * len(amounts[::50])
+    df = donations(amounts)
+    df["Account ID"] = np.arange(len(df))
+    df["Number of Gifts Past 18 Months"] = rng.integers(0, 3, len(df))
+    stats = segment_stats(df)
+    for segment, rows in [("All", df), ("Active", df[df["Number of Gifts Past 18 Months"] > 0]),
+                          ("Inactive", df[df["Number of Gifts Past 18 Months"] == 0])]:
+        expected = precise_stats(rows)
+        assert f"{stats.loc[segment, 'Total Donation Amount']:,.2f}" == expected["total"]
+        assert f"{stats.loc[segment, 'Average Total Donation']:,.2f}" == expected["average"]
+        assert f"{stats.loc[segment, 'Median Total Donation']:,.2f}" == expected["median"]
+        assert f"{stats.loc[segment, 'Modal Total Donation']:,.2f}" == expected["mode"]